@@ -0,0 +1,173 @@
+"""后台视频分析任务
+
+直接读取上传的视频文件，按采样间隔解码、计算特征并预测（见stream_inference），
+不提取和保存视频帧，也不需要标注，结果只保存为 ``VideoAnalysis.timeline`` 中的行为时间线。
+分析请求只创建记录并提交到线程池后立即返回，结果页面轮询 ``/analysis/<ID>/status`` 显示进度。
+服务重启时未完成的分析被标记为失败。
+"""
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import app, db
+from app_logging import get_job_logger
+from features import DEFAULT_EXTRACTOR, get_extractor
+from ingest import resolve_video_path
+from model_cache import load_model
+from models import DataFile, Model, VideoAnalysis
+from stream_inference import StreamingPipeline, TimelineBuilder, timeline_summary
+
+logger = logging.getLogger(__name__)
+
+# 未结束的分析状态
+ACTIVE_STATES = ('queued', 'running')
+
+# 更新分析记录的进度和时间线的最小间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+_executor = None
+
+
+def _get_executor():
+    """延迟创建线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['ANALYSIS_WORKERS'], thread_name_prefix='analyze')
+    return _executor
+
+
+def enqueue_analysis(model, data_file, interval=None):
+    """
+    创建分析记录并提交到后台线程池
+    :param interval: 采样间隔（秒），为None时使用ANALYSIS_SAMPLE_INTERVAL
+    :return: VideoAnalysis
+    """
+    if interval is None:
+        interval = app.config['ANALYSIS_SAMPLE_INTERVAL']
+    analysis = VideoAnalysis(model_id=model.id, data_file_id=data_file.id, sample_interval=interval,
+                             state='queued', progress=0)
+    db.session.add(analysis)
+    db.session.commit()
+    _get_executor().submit(run_analysis, analysis.id)
+    get_job_logger(__name__, analysis=analysis.id).info(
+        "已提交视频分析: 模型=%s, 数据文件=%s, 采样间隔=%ss", model.model_name, data_file.filename, interval)
+    return analysis
+
+
+def get_analysis_status(analysis):
+    """
+    分析的状态和当前的时间线，供结果页面轮询
+    :return: {'analysis_id', 'state', 'progress', 'error', 'finished', 'frame_count', 'duration', 'fps',
+              'timeline', 'summary'}
+    """
+    timeline = json.loads(analysis.timeline) if analysis.timeline else []
+    return {
+        'analysis_id': analysis.id,
+        'state': analysis.state,
+        'progress': analysis.progress,
+        'error': analysis.error,
+        'finished': analysis.state not in ACTIVE_STATES,
+        'frame_count': analysis.frame_count or 0,
+        'duration': analysis.duration,
+        'fps': analysis.fps,
+        'timeline': timeline,
+        'summary': timeline_summary(timeline)
+    }
+
+
+def run_analysis(analysis_id):
+    """在后台线程中执行分析"""
+    log = get_job_logger(__name__, analysis=analysis_id)
+    with app.app_context():
+        try:
+            _analyze(db.session.get(VideoAnalysis, analysis_id), log)
+        except Exception as e:
+            log.exception("视频分析失败")
+            db.session.rollback()
+            analysis = db.session.get(VideoAnalysis, analysis_id)
+            if analysis is not None:
+                analysis.state = 'failed'
+                analysis.error = str(e)
+                analysis.finished_at = datetime.utcnow()
+                db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _analyze(analysis, log):
+    model = db.session.get(Model, analysis.model_id)
+    data_file = db.session.get(DataFile, analysis.data_file_id)
+    if model is None or data_file is None:
+        raise ValueError('模型或数据文件已被删除')
+    if data_file.file_type != 'video':
+        raise ValueError('只能分析视频文件')
+    video_path = resolve_video_path(data_file)
+    if video_path is None:
+        raise ValueError(f'找不到视频文件: {data_file.filename}')
+    analysis.state = 'running'
+    analysis.started_at = datetime.utcnow()
+    db.session.commit()
+
+    bundle = load_model(model)
+    try:
+        extractor = get_extractor(bundle.get('feature_extractor', DEFAULT_EXTRACTOR.key))
+    except ValueError as e:
+        raise ValueError(f'模型的特征提取器不可用: {e}')
+
+    pipeline = StreamingPipeline(video_path, bundle, extractor, analysis.sample_interval,
+                                 batch_size=app.config['EVAL_BATCH_SIZE'],
+                                 feature_workers=app.config['EVAL_FEATURE_WORKERS'],
+                                 queue_size=app.config['ANALYSIS_QUEUE_SIZE'],
+                                 strategy=app.config['FRAME_EXTRACT_STRATEGY'])
+    start = time.monotonic()
+    pipeline.start()
+    try:
+        duration = pipeline.total_frames / pipeline.fps if pipeline.total_frames > 0 else None
+        builder = TimelineBuilder(pipeline.fps, pipeline.step)
+        log.info("开始分析: 模型=%s, 视频=%s, 帧率=%.2f, 总帧数=%d", model.model_name, video_path, pipeline.fps,
+                 pipeline.total_frames)
+        last_update = start
+        for frame_numbers, labels, confidence in pipeline:
+            builder.add(frame_numbers, labels, confidence)
+            if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                if pipeline.total_frames > 0:
+                    analysis.progress = min(int(100 * (frame_numbers[-1] + 1) / pipeline.total_frames), 99)
+                analysis.frame_count = builder.samples
+                analysis.duration = duration
+                analysis.timeline = json.dumps(builder.timeline(duration), ensure_ascii=False)
+                db.session.commit()
+                last_update = time.monotonic()
+    finally:
+        # 提前退出（出错）时停止流水线的各个线程
+        pipeline.close()
+
+    elapsed = time.monotonic() - start
+    if duration is None and builder.segments:
+        duration = builder.segments[-1]['end']
+    analysis.duration = duration
+    analysis.frame_count = builder.samples
+    analysis.timeline = json.dumps(builder.timeline(duration), ensure_ascii=False)
+    analysis.fps = builder.samples / elapsed if elapsed > 0 else None
+    analysis.state = 'succeeded'
+    analysis.progress = 100
+    analysis.finished_at = datetime.utcnow()
+    db.session.commit()
+    log.info("分析完成: 采样帧数=%d, 时间线段数=%d, 耗时=%.2fs", builder.samples, len(builder.segments), elapsed)
+
+
+def recover_analyses():
+    """服务启动时把未完成的分析标记为失败（分析线程随Web进程退出）"""
+    # 训练进程导入app时也会执行到这里，只在Web进程中检查
+    if multiprocessing.parent_process() is not None:
+        return
+    analyses = VideoAnalysis.query.filter(VideoAnalysis.state.in_(ACTIVE_STATES)).all()
+    for analysis in analyses:
+        analysis.state = 'failed'
+        analysis.error = '服务重启，分析未完成'
+        analysis.finished_at = datetime.utcnow()
+    if analyses:
+        db.session.commit()
+        logger.warning("%d 个未完成的分析已标记为失败", len(analyses))
@@ -1,12 +1,76 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
 import os
+import logging
+from app_logging import setup_logging
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///teaching_behavior.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+# 视频帧提取策略：auto（按间隔自动选择grab或定位）、grab（顺序grab）、seek（逐帧定位）
+app.config['FRAME_EXTRACT_STRATEGY'] = os.environ.get('FRAME_EXTRACT_STRATEGY', 'auto')
+# 后台帧提取进程数和最多排队的任务数
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['INGEST_MAX_PENDING'] = int(os.environ.get('INGEST_MAX_PENDING', 8))
+# 单个视频并行解码的进程数，长视频按帧范围切分后在多个进程中提取
+app.config['FRAME_EXTRACT_WORKERS'] = int(os.environ.get('FRAME_EXTRACT_WORKERS', 1))
+# 帧采样方式：interval（固定间隔）或scene（画面变化超过阈值时保留），
+# 场景采样的探测间隔（秒）、变化阈值（0-1）和相邻保留帧的最小/最大间隔（秒）
+app.config['FRAME_SAMPLING'] = os.environ.get('FRAME_SAMPLING', 'interval')
+app.config['FRAME_SCENE_PROBE_INTERVAL'] = float(os.environ.get('FRAME_SCENE_PROBE_INTERVAL', 0.5))
+app.config['FRAME_SCENE_THRESHOLD'] = float(os.environ.get('FRAME_SCENE_THRESHOLD', 0.25))
+app.config['FRAME_SCENE_MIN_GAP'] = float(os.environ.get('FRAME_SCENE_MIN_GAP', 1.0))
+app.config['FRAME_SCENE_MAX_GAP'] = float(os.environ.get('FRAME_SCENE_MAX_GAP', 30.0))
+# 提取时生成的预览图：缩略图和中等尺寸预览的最长边像素（0表示不生成）、格式（jpg或webp）和质量
+app.config['FRAME_THUMB_SIZE'] = int(os.environ.get('FRAME_THUMB_SIZE', 240))
+app.config['FRAME_MEDIUM_SIZE'] = int(os.environ.get('FRAME_MEDIUM_SIZE', 640))
+app.config['FRAME_PREVIEW_FORMAT'] = os.environ.get('FRAME_PREVIEW_FORMAT', 'jpg')
+app.config['FRAME_PREVIEW_QUALITY'] = int(os.environ.get('FRAME_PREVIEW_QUALITY', 80))
+# 训练使用的特征提取器，可选raw64/gray32/hog/color_hist/hog_color（见features.py）
+app.config['TRAIN_FEATURE_EXTRACTOR'] = os.environ.get('TRAIN_FEATURE_EXTRACTOR', 'hog_color')
+# 默认训练方式：full（全量）、incremental（在最新模型基础上只学习新增的标注）或search（交叉验证参数搜索）
+app.config['TRAIN_MODE'] = os.environ.get('TRAIN_MODE', 'full')
+# 全量训练使用的分类器：svc（线性SVM）或sgd（可以增量训练的在线线性分类器），增量训练总是使用sgd
+app.config['TRAIN_CLASSIFIER'] = os.environ.get('TRAIN_CLASSIFIER', 'svc')
+# 连续增量训练多少次后改为全量训练（0表示不强制全量训练），sgd每次训练遍历数据的轮数
+app.config['TRAIN_FULL_RETRAIN_EVERY'] = int(os.environ.get('TRAIN_FULL_RETRAIN_EVERY', 10))
+app.config['TRAIN_SGD_EPOCHS'] = int(os.environ.get('TRAIN_SGD_EPOCHS', 5))
+# 参数搜索（search训练方式）的候选特征提取器、交叉验证折数和并行进程数
+app.config['TRAIN_SEARCH_EXTRACTORS'] = os.environ.get('TRAIN_SEARCH_EXTRACTORS', 'hog_color,hog,color_hist').split(',')
+app.config['TRAIN_SEARCH_FOLDS'] = int(os.environ.get('TRAIN_SEARCH_FOLDS', 5))
+app.config['TRAIN_SEARCH_WORKERS'] = int(os.environ.get('TRAIN_SEARCH_WORKERS', os.cpu_count() or 1))
+# 训练特征矩阵的内存预算（MB），超过时写入磁盘上的内存映射文件
+app.config['TRAIN_MEMORY_BUDGET_MB'] = int(os.environ.get('TRAIN_MEMORY_BUDGET_MB', 1024))
+# 取消训练后等待训练进程自行退出的秒数，超时后结束训练进程
+app.config['TRAIN_CANCEL_GRACE'] = float(os.environ.get('TRAIN_CANCEL_GRACE', 10))
+# 训练时并行解码和计算特征的线程数
+app.config['TRAIN_FEATURE_WORKERS'] = int(os.environ.get('TRAIN_FEATURE_WORKERS', min(4, os.cpu_count() or 1)))
+# 同时执行的后台评估数量
+app.config['EVAL_WORKERS'] = int(os.environ.get('EVAL_WORKERS', 1))
+# 评估时每批读取特征和预测的帧数，以及并行解码和计算未缓存特征的线程数
+app.config['EVAL_BATCH_SIZE'] = int(os.environ.get('EVAL_BATCH_SIZE', 256))
+app.config['EVAL_FEATURE_WORKERS'] = int(os.environ.get('EVAL_FEATURE_WORKERS', min(4, os.cpu_count() or 1)))
+# 直接分析视频（不提取帧）：同时执行的分析数量、默认采样间隔（秒）和解码线程与特征线程之间的帧队列长度，
+# 每批预测的帧数和特征线程数与评估相同（EVAL_BATCH_SIZE、EVAL_FEATURE_WORKERS）
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 1))
+app.config['ANALYSIS_SAMPLE_INTERVAL'] = float(os.environ.get('ANALYSIS_SAMPLE_INTERVAL', 1.0))
+app.config['ANALYSIS_QUEUE_SIZE'] = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 32))
+# 实时识别：延迟预算（毫秒，采集后超过该时间还没有开始识别的帧被丢弃）和同时运行的会话数上限
+app.config['REALTIME_LATENCY_BUDGET_MS'] = float(os.environ.get('REALTIME_LATENCY_BUDGET_MS', 200))
+app.config['REALTIME_MAX_SESSIONS'] = int(os.environ.get('REALTIME_MAX_SESSIONS', 2))
+# 实时识别允许的网络视频流协议（页面只能填写摄像头编号或这些协议的地址，不能填写服务器上的文件路径）
+app.config['REALTIME_STREAM_SCHEMES'] = os.environ.get('REALTIME_STREAM_SCHEMES', 'rtsp,rtsps,rtmp,rtmps').split(',')
+# 进程内模型缓存的大小上限（MB，按模型文件大小计算）以及启动时是否预加载最新的模型
+app.config['MODEL_CACHE_MB'] = int(os.environ.get('MODEL_CACHE_MB', 512))
+app.config['MODEL_CACHE_WARM_UP'] = os.environ.get('MODEL_CACHE_WARM_UP', '1') != '0'
+# 日志级别（DEBUG会输出逐帧信息，生产环境使用INFO）和日志文件
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['LOG_FILE'] = os.environ.get('LOG_FILE', os.path.join('logs', 'app.log'))
+
+setup_logging(app.config['LOG_LEVEL'], app.config['LOG_FILE'])
+logger = logging.getLogger(__name__)
 
 # 创建上传目录
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -24,7 +88,7 @@ if not os.path.exists('models'):
 frames_dir = os.path.join('static', 'frames')
 if not os.path.exists(frames_dir):
     os.makedirs(frames_dir)
-    print(f"创建视频帧目录: {frames_dir}")
+    logger.info("创建视频帧目录: %s", frames_dir)
 
 db = SQLAlchemy(app)
 
@@ -0,0 +1,146 @@
+"""日志配置
+
+所有模块通过 ``logging.getLogger(__name__)`` 记录日志，日志记录先写入内存队列，
+再由后台监听线程统一写入按大小轮转的日志文件和控制台，请求线程和解码循环不做文件I/O。
+后台进程（帧提取等）通过 :func:`get_worker_log_queue` 返回的跨进程队列把日志发回主进程。
+
+逐帧的调试信息使用DEBUG级别，默认的INFO级别下不会输出。
+"""
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(processName)s] %(name)s [%(job)s] %(message)s'
+
+_listeners = []
+_handlers = []
+_worker_queue = None
+_worker_manager = None
+
+
+class JobContextFilter(logging.Filter):
+    """为没有任务上下文的日志记录补充默认的job字段"""
+
+    def filter(self, record):
+        if not hasattr(record, 'job'):
+            record.job = '-'
+        return True
+
+
+class JobLoggerAdapter(logging.LoggerAdapter):
+    """在日志中附带任务上下文，例如 file_id=3"""
+
+    def process(self, msg, kwargs):
+        extra = dict(kwargs.get('extra') or {})
+        extra['job'] = ' '.join(f'{key}={value}' for key, value in self.extra.items())
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+
+def get_job_logger(name, **context):
+    """
+    获取带任务上下文的日志记录器
+    :param name: 日志记录器名称，一般为模块的__name__
+    :param context: 任务上下文，例如 file_id=3, job_id=5
+    """
+    return JobLoggerAdapter(logging.getLogger(name), context)
+
+
+def _parse_level(level):
+    if isinstance(level, str):
+        return logging.getLevelName(level.upper())
+    return level
+
+
+def setup_logging(level='INFO', log_file='logs/app.log', max_bytes=10 * 1024 * 1024, backup_count=5):
+    """
+    配置主进程的日志：内存队列 + 后台监听线程 + 轮转文件/控制台输出
+    :param level: 日志级别，生产环境使用INFO，DEBUG会输出逐帧信息
+    :param log_file: 日志文件路径
+    :param max_bytes: 单个日志文件的最大字节数
+    :param backup_count: 保留的历史日志文件数量
+    """
+    # 后台子进程通过configure_worker_logging把日志发回主进程
+    if multiprocessing.parent_process() is not None or _listeners:
+        return
+
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+        handler.addFilter(JobContextFilter())
+        _handlers.append(handler)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(_parse_level(level))
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    atexit.register(stop_logging)
+
+
+def get_worker_log_queue(ctx=None):
+    """
+    获取后台进程使用的跨进程日志队列，并在主进程中启动对应的监听线程
+    :param ctx: multiprocessing上下文，默认为spawn
+    """
+    global _worker_queue, _worker_manager
+    if _worker_queue is None:
+        ctx = ctx or multiprocessing.get_context('spawn')
+        _worker_manager = ctx.Manager()
+        _worker_queue = _worker_manager.Queue(-1)
+        if _handlers:
+            listener = logging.handlers.QueueListener(_worker_queue, *_handlers, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+            # 在Manager进程退出之前停止监听（atexit按注册的相反顺序执行）
+            atexit.register(_stop_listener, listener)
+    return _worker_queue
+
+
+def configure_worker_logging(log_queue, level='INFO'):
+    """
+    在后台进程中把日志发送到主进程的队列，可重复调用
+    :param log_queue: get_worker_log_queue返回的队列，为None时不做任何配置
+    :param level: 日志级别
+    """
+    if log_queue is None:
+        return
+    root = logging.getLogger()
+    root.setLevel(_parse_level(level))
+    for handler in root.handlers:
+        if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is log_queue:
+            return
+    # 移除子进程中残留的处理器，避免重复输出
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+    root.addHandler(queue_handler)
+
+
+def _stop_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+        listener.stop()
+
+
+def stop_logging():
+    """停止监听线程并写出队列中剩余的日志"""
+    while _listeners:
+        _listeners.pop().stop()
@@ -0,0 +1,53 @@
+"""比较各特征提取器的特征大小和提取耗时
+
+用法: python benchmark_features.py [数据文件ID ...] [--frames N]
+不指定数据文件时使用 static/frames 下所有已提取的视频帧
+"""
+import os
+import sys
+import argparse
+
+from features import EXTRACTORS, benchmark_extractors
+from frame_store import get_frames_dir, list_frame_indices, read_frame
+
+
+def load_sample_frames(file_ids, max_frames):
+    images = []
+    for file_id in file_ids:
+        frames_dir = get_frames_dir(file_id)
+        indices = list_frame_indices(frames_dir)
+        step = max(len(indices) // max(max_frames - len(images), 1), 1)
+        for index in indices[::step]:
+            if len(images) >= max_frames:
+                return images
+            image = read_frame(frames_dir, index)
+            if image is not None:
+                images.append(image)
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较各特征提取器的特征大小和提取耗时')
+    parser.add_argument('file_ids', nargs='*', help='数据文件ID')
+    parser.add_argument('--frames', type=int, default=200, help='最多使用的帧数')
+    args = parser.parse_args()
+
+    file_ids = args.file_ids
+    if not file_ids:
+        frames_root = os.path.join('static', 'frames')
+        file_ids = sorted(os.listdir(frames_root)) if os.path.exists(frames_root) else []
+
+    images = load_sample_frames(file_ids, args.frames)
+    if not images:
+        print('没有可用的视频帧，请先上传视频并提取帧')
+        sys.exit(1)
+
+    print(f'样本帧数: {len(images)}, 帧尺寸: {images[0].shape[1]}x{images[0].shape[0]}')
+    print(f'{"特征提取器":<16}{"维数":>8}{"字节/帧":>10}{"1万帧(MB)":>12}{"毫秒/帧":>10}  说明')
+    for row in benchmark_extractors(images, list(EXTRACTORS.values())):
+        print(f'{row["key"]:<16}{row["dim"]:>8}{row["bytes"]:>10}{row["bytes"] * 10000 / 2 ** 20:>12.1f}'
+              f'{row["ms_per_frame"]:>10.3f}  {row["description"]}')
+
+
+if __name__ == '__main__':
+    main()
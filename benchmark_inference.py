@@ -0,0 +1,79 @@
+"""比较sklearn模型和导出的线性模型的预测耗时
+
+用法: python benchmark_inference.py [模型文件] [--files 数据文件ID ...] [--rows N]
+不指定模型文件时使用 models 目录中最新的模型，不指定数据文件时使用 static/frames 下所有已提取的视频帧；
+样本帧的特征重复拼接到N行后计时，线性模型的预测结果与sklearn模型不一致时以状态码1退出
+"""
+import os
+import sys
+import argparse
+
+import joblib
+import numpy as np
+
+from feature_store import get_frame_features
+from features import DEFAULT_EXTRACTOR, get_extractor
+from frame_store import get_frames_dir, list_frame_indices
+from linear_inference import benchmark_inference, load_linear
+
+
+def load_sample_features(file_ids, extractor, max_frames):
+    rows = []
+    for file_id in file_ids:
+        indices = list_frame_indices(get_frames_dir(file_id))[:max_frames - sum(len(r) for r in rows)]
+        if not indices:
+            continue
+        features, valid = get_frame_features(file_id, indices, extractor)
+        rows.append(np.asarray(features[valid]))
+    return np.concatenate(rows) if rows else np.empty((0, extractor.dim), dtype=extractor.dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较sklearn模型和导出的线性模型的预测耗时')
+    parser.add_argument('model_path', nargs='?', help='模型文件')
+    parser.add_argument('--files', nargs='*', default=[], help='数据文件ID')
+    parser.add_argument('--frames', type=int, default=500, help='最多使用的帧数')
+    parser.add_argument('--rows', type=int, default=5000, help='计时的样本行数')
+    args = parser.parse_args()
+
+    model_path = args.model_path
+    if model_path is None:
+        candidates = [os.path.join('models', name) for name in os.listdir('models')
+                      if name.endswith('.joblib')] if os.path.exists('models') else []
+        if not candidates:
+            print('没有可用的模型，请先训练模型')
+            sys.exit(1)
+        model_path = max(candidates, key=os.path.getmtime)
+
+    bundle = joblib.load(model_path)
+    extractor = get_extractor(bundle.get('feature_extractor', DEFAULT_EXTRACTOR.key))
+
+    file_ids = args.files
+    if not file_ids:
+        frames_root = os.path.join('static', 'frames')
+        file_ids = sorted(os.listdir(frames_root)) if os.path.exists(frames_root) else []
+    X = load_sample_features(file_ids, extractor, args.frames)
+    if not len(X):
+        print('没有可用的视频帧，请先上传视频并提取帧')
+        sys.exit(1)
+    samples = len(X)
+    X = X[np.arange(args.rows) % samples]
+
+    linear = load_linear(model_path, bundle)
+    print(f'模型: {model_path} ({type(bundle["model"]).__name__}), 特征: {extractor.key} ({extractor.dim}维)')
+    print(f'样本帧数: {samples}, 计时行数: {len(X)}')
+    if linear is None:
+        print('该模型不是线性模型，只测试sklearn')
+    print(f'{"方式":<20}{"毫秒/帧":>10}{"加速":>8}{"一致率":>8}')
+    results = benchmark_inference(bundle, linear, X)
+    baseline = results[0]['ms_per_frame']
+    for row in results:
+        print(f'{row["name"]:<20}{row["ms_per_frame"]:>10.4f}{baseline / row["ms_per_frame"]:>7.1f}x'
+              f'{row["agreement"] * 100:>7.1f}%')
+    if any(row['agreement'] < 1 for row in results):
+        print('预测结果与sklearn模型不一致，请检查导出的线性模型')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 from app import app
-from routes import TRAINING_STATUS, TRAINING_LOCK
+from models import TrainingJob
+from train_jobs import get_active_job, get_job_status
 
-print('Training status:', TRAINING_STATUS)
-print('Training lock:', TRAINING_LOCK.locked())
\ No newline at end of file
+with app.app_context():
+    latest_job = TrainingJob.query.order_by(TrainingJob.id.desc()).first()
+    print('Training status:', get_job_status(latest_job))
+    print('Training running:', get_active_job() is not None)
\ No newline at end of file
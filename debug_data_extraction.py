@@ -1,24 +1,23 @@
 from app import app, db
-from models import DataFile, Annotation
+from repository import load_annotations
 import os
 import cv2
 import numpy as np
 
 with app.app_context():
     # 获取已标注的数据
-    annotated_files = DataFile.query.filter_by(status='annotated').all()
+    annotations_index = load_annotations()
     
     # 准备训练数据
     X = []
     y = []
     
-    total_annotations = sum(len(Annotation.query.filter_by(data_file_id=file.id).all()) for file in annotated_files)
+    total_annotations = len(annotations_index)
     processed_annotations = 0
     
     print(f'总标注数量: {total_annotations}')
     
-    for file in annotated_files:
-        annotations = Annotation.query.filter_by(data_file_id=file.id).all()
+    for file, annotations in annotations_index.items():
         
         print(f'处理文件: {file.filename}')
         print(f'文件类型: {file.file_type}')
@@ -1,5 +1,6 @@
 from app import app, db
-from models import Model, DataFile, Annotation
+from models import Model
+from repository import load_annotations
 import os
 import cv2
 import numpy as np
@@ -11,15 +12,14 @@ from datetime import datetime
 
 with app.app_context():
     # 获取已标注的数据
-    annotated_files = DataFile.query.filter_by(status='annotated').all()
+    annotations_index = load_annotations()
     
     # 准备训练数据
     X = []
     y = []
     
     # 处理每个已标注的文件
-    for file in annotated_files:
-        annotations = Annotation.query.filter_by(data_file_id=file.id).all()
+    for file, annotations in annotations_index.items():
         
         # 构建视频文件路径
         video_path = None
@@ -1,5 +1,6 @@
 from app import app, db
-from models import Model, DataFile, Annotation
+from models import Model, DataFile
+from repository import load_annotations
 import os
 
 with app.app_context():
@@ -8,17 +9,17 @@ with app.app_context():
     print(f'已标注数据文件数量: {annotated_count}')
     
     # 检查所有已标注的数据文件
-    annotated_files = DataFile.query.filter_by(status='annotated').all()
-    print(f'已标注数据文件: {[f.filename for f in annotated_files]}')
+    annotations_index = load_annotations()
+    print(f'已标注数据文件: {[f.filename for f in annotations_index.files]}')
     
     # 检查标注数量
-    total_annotations = sum(len(file.annotations) for file in annotated_files)
+    total_annotations = len(annotations_index)
     print(f'总标注数量: {total_annotations}')
     
     # 检查标注详情
-    for file in annotated_files:
+    for file, annotations in annotations_index.items():
         print(f'文件 {file.filename} 的标注:')
-        for annotation in file.annotations:
+        for annotation in annotations:
             print(f'  - 行为: {annotation.behavior}, 时间戳: {annotation.timestamp}, 坐标: {annotation.coordinates}')
     
     # 检查models目录
@@ -0,0 +1,329 @@
+"""后台评估任务
+
+评估请求只创建 ``Evaluation`` 记录并提交到线程池后立即返回，评估在后台按帧编号顺序覆盖视频的全部帧。
+评估的主要耗时是解码未缓存的帧和计算特征（cv2会释放GIL）以及矩阵乘法，使用Web进程中的线程即可。
+
+每批帧的预测结果（行为、置信度、评估时的标注）批量写入 ``FramePrediction`` 表，结果页面通过
+``/evaluation/<ID>/events``（Server-Sent Events）接收进度和当前的指标，并可以分页浏览已经完成的帧；
+评估完成后指标写入 ``Evaluation.metrics``。服务重启时未完成的评估被标记为失败。
+
+评估记录保存评估时模型文件、视频帧和标注的版本（``source_version``），
+同一模型和数据文件再次评估时，如果三者都没有变化，直接返回已有的评估结果。
+"""
+import os
+import json
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+
+from app import app, db
+from app_logging import get_job_logger
+from evaluation import evaluation_metrics, metrics_to_json, predict_frame_batches
+from features import DEFAULT_EXTRACTOR, get_extractor
+from frame_store import get_frames_dir, get_frames_version
+from ingest import ensure_frame_manifest
+from linear_inference import predict_labels
+from model_cache import load_model
+from models import DataFile, Evaluation, Frame, FramePrediction, Model, TeachingBehavior
+from repository import get_annotations_version, load_annotations, save_frame_predictions
+
+logger = logging.getLogger(__name__)
+
+# 未结束的评估状态
+ACTIVE_STATES = ('queued', 'running')
+
+# 重新计算当前指标、更新评估记录进度的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+_executor = None
+# 正在排队或执行的评估：evaluation_id -> EvaluationRun
+_runs = {}
+_lock = threading.Lock()
+
+
+class EvaluationRun:
+    """
+    一次评估在内存中的预测和标注行为，用于计算当前指标；评估线程追加，请求线程读取
+    :param labels: 指标中包含的行为（已定义的全部行为）
+    """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.predicted = []
+        self.true = []
+        # 需要评估的帧数和已经处理的帧数（包括读取失败、没有预测结果的帧）
+        self.total = None
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._metrics = None
+        self._metrics_done = -1
+        self._metrics_time = 0
+
+    @property
+    def done(self):
+        return len(self.predicted)
+
+    def add(self, frames):
+        """追加一批帧的预测结果"""
+        with self._lock:
+            for frame in frames:
+                self.predicted.append(frame['behavior'])
+                self.true.append(frame['true_behavior'])
+
+    def metrics(self, force=False):
+        """
+        当前已完成的帧的指标，最多每PROGRESS_INTERVAL秒重新计算一次
+        :return: evaluation_metrics的结果
+        """
+        with self._lock:
+            stale = self._metrics_done != self.done
+            due = force or time.monotonic() - self._metrics_time >= PROGRESS_INTERVAL
+            if self._metrics is None or (stale and due):
+                self._metrics = evaluation_metrics(self.predicted, self.true, self.labels)
+                self._metrics_done = self.done
+                self._metrics_time = time.monotonic()
+            return self._metrics
+
+
+def get_run(evaluation_id):
+    """正在排队或执行的评估的内存结果，评估已结束时返回None"""
+    with _lock:
+        return _runs.get(evaluation_id)
+
+
+def _get_executor():
+    """延迟创建线程池"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=app.config['EVAL_WORKERS'], thread_name_prefix='evaluate')
+    return _executor
+
+
+def get_behavior_keys():
+    """已定义的全部行为，指标中按该顺序排列"""
+    return [behavior.key for behavior in TeachingBehavior.query.order_by(TeachingBehavior.id).all()]
+
+
+def get_source_version(model, data_file):
+    """
+    评估结果依赖的模型文件、视频帧（或图片文件）和标注的版本
+    :return: 版本字符串，文件不存在或视频帧尚未提取时返回None（不复用评估结果）
+    """
+    if not os.path.exists(model.model_path):
+        return None
+    if data_file.file_type == 'video':
+        frames_version = get_frames_version(get_frames_dir(data_file.id))
+    elif os.path.exists(data_file.filepath):
+        stat = os.stat(data_file.filepath)
+        frames_version = f'{stat.st_mtime_ns}-{stat.st_size}'
+    else:
+        frames_version = None
+    if frames_version is None:
+        return None
+    return f'{os.path.getmtime(model.model_path)}|{frames_version}|{get_annotations_version(data_file.id)}'
+
+
+def find_reusable_evaluation(model, data_file, source_version):
+    """同一模型和数据文件、版本相同且已完成或正在进行的最新评估"""
+    if source_version is None:
+        return None
+    return Evaluation.query.filter(
+        Evaluation.model_id == model.id,
+        Evaluation.data_file_id == data_file.id,
+        Evaluation.source_version == source_version,
+        Evaluation.state.in_(ACTIVE_STATES + ('succeeded',))
+    ).order_by(Evaluation.id.desc()).first()
+
+
+def enqueue_evaluation(model, data_file, force=False):
+    """
+    创建评估记录并提交到后台线程池
+    :param force: 为True时即使模型和数据文件都没有变化也重新评估
+    :return: (Evaluation, 是否复用了已有的评估)
+    """
+    source_version = get_source_version(model, data_file)
+    if not force:
+        evaluation = find_reusable_evaluation(model, data_file, source_version)
+        if evaluation is not None:
+            get_job_logger(__name__, evaluation=evaluation.id).info(
+                "模型和数据文件都没有变化，复用评估结果: 模型=%s, 数据文件=%s", model.model_name, data_file.filename)
+            return evaluation, True
+    evaluation = Evaluation(model_id=model.id, data_file_id=data_file.id, correct_predictions=0,
+                            total_predictions=0, accuracy=0, frame_count=0, state='queued', progress=0,
+                            source_version=source_version)
+    db.session.add(evaluation)
+    db.session.commit()
+    with _lock:
+        _runs[evaluation.id] = EvaluationRun(get_behavior_keys())
+    _get_executor().submit(run_evaluation, evaluation.id)
+    get_job_logger(__name__, evaluation=evaluation.id).info(
+        "已提交评估: 模型=%s, 数据文件=%s", model.model_name, data_file.filename)
+    return evaluation, False
+
+
+def get_evaluation_status(evaluation):
+    """
+    评估的状态和当前指标，供 /evaluation/<ID>/events 发送
+    :return: {'evaluation_id', 'state', 'progress', 'done': 已有预测结果的帧数, 'total': 需要评估的帧数,
+              'error', 'finished', 'metrics'}
+    """
+    run = get_run(evaluation.id)
+    state = evaluation.state or 'succeeded'
+    if run is not None and state in ACTIVE_STATES:
+        metrics = metrics_to_json(run.metrics())
+        done, total = run.done, run.total
+        progress = int(100 * run.processed / total) if total else 0
+    else:
+        metrics = json.loads(evaluation.metrics) if evaluation.metrics else None
+        done = total = evaluation.frame_count or 0
+        progress = evaluation.progress if evaluation.progress is not None else 100
+    return {
+        'evaluation_id': evaluation.id,
+        'state': state,
+        'progress': progress,
+        'done': done,
+        'total': total,
+        'error': evaluation.error,
+        'finished': state not in ACTIVE_STATES,
+        'metrics': metrics
+    }
+
+
+def run_evaluation(evaluation_id):
+    """在后台线程中执行评估"""
+    log = get_job_logger(__name__, evaluation=evaluation_id)
+    run = get_run(evaluation_id)
+    with app.app_context():
+        try:
+            _evaluate(db.session.get(Evaluation, evaluation_id), run, log)
+        except Exception as e:
+            log.exception("评估失败")
+            db.session.rollback()
+            evaluation = db.session.get(Evaluation, evaluation_id)
+            if evaluation is not None:
+                evaluation.state = 'failed'
+                evaluation.error = str(e)
+                evaluation.finished_at = datetime.utcnow()
+                db.session.commit()
+        finally:
+            # 指标已经写入数据库后再移除内存中的结果
+            with _lock:
+                _runs.pop(evaluation_id, None)
+            db.session.remove()
+
+
+def _evaluate(evaluation, run, log):
+    model = db.session.get(Model, evaluation.model_id)
+    data_file = db.session.get(DataFile, evaluation.data_file_id)
+    if model is None or data_file is None:
+        raise ValueError('模型或数据文件已被删除')
+    evaluation.state = 'running'
+    evaluation.started_at = datetime.utcnow()
+    db.session.commit()
+    log.info("开始评估: 模型=%s, 数据文件=%s", model.model_name, data_file.filename)
+
+    # 加载模型（进程内缓存，模型文件变化后重新加载）
+    bundle = load_model(model)
+    # 早期的模型文件没有记录特征提取器，使用64x64像素特征
+    try:
+        extractor = get_extractor(bundle.get('feature_extractor', DEFAULT_EXTRACTOR.key))
+    except ValueError as e:
+        raise ValueError(f'模型的特征提取器不可用: {e}')
+
+    # 一次加载该文件的全部标注，按帧编号查找
+    annotations = load_annotations(status=None, file_id=data_file.id)
+
+    if data_file.file_type == 'image':
+        run.total = 1
+        img = cv2.imread(data_file.filepath)
+        if img is not None:
+            file_annotations = annotations.for_file(data_file.id)
+            ann = file_annotations[0] if file_annotations else None
+            predicted, confidence = predict_labels(bundle, extractor(img).reshape(1, -1), return_confidence=True)
+            frames = [{
+                'frame_index': 0,
+                'behavior': str(predicted[0]),
+                'confidence': _confidence(confidence[0]),
+                'coordinates': ann.coordinates if ann else '',
+                'true_behavior': ann.behavior if ann else None
+            }]
+            save_frame_predictions(evaluation.id, frames)
+            db.session.commit()
+            run.add(frames)
+        run.processed = 1
+
+    elif data_file.file_type == 'video':
+        # 按帧编号顺序评估全部已提取的帧
+        ensure_frame_manifest(data_file)
+        frame_indices = [row.frame_index for row in db.session.query(Frame.frame_index).filter_by(
+            data_file_id=data_file.id).order_by(Frame.frame_index).all()]
+        run.total = len(frame_indices)
+        batch_size = app.config['EVAL_BATCH_SIZE']
+        last_update = time.monotonic()
+
+        # 按批读取特征（未缓存的帧才解码）并批量预测
+        batches = predict_frame_batches(bundle, data_file.id, frame_indices, extractor, batch_size,
+                                        app.config['EVAL_FEATURE_WORKERS'])
+        for positions, predicted, confidence in batches:
+            frames = []
+            for position, predicted_behavior, frame_confidence in zip(positions, predicted, confidence):
+                frame_index = frame_indices[position]
+                # 查找该帧是否有标注
+                ann = annotations.get(data_file.id, frame_index)
+                frames.append({
+                    'frame_index': frame_index,
+                    'behavior': str(predicted_behavior),
+                    'confidence': _confidence(frame_confidence),
+                    'coordinates': ann.coordinates if ann else '',
+                    'true_behavior': ann.behavior if ann else None
+                })
+            # 每批写入一次并提交，结果页面可以分页浏览已经完成的帧
+            save_frame_predictions(evaluation.id, frames)
+            run.processed = min(run.processed + batch_size, run.total)
+            if time.monotonic() - last_update >= PROGRESS_INTERVAL:
+                evaluation.progress = int(100 * run.processed / run.total)
+                last_update = time.monotonic()
+            db.session.commit()
+            run.add(frames)
+            log.debug("预测 %d 帧", len(frames))
+    else:
+        raise ValueError(f'不支持的文件类型: {data_file.file_type}')
+
+    # 全部帧预测完成后一次计算各行为的出现次数、精确率、召回率和混淆矩阵
+    metrics = run.metrics(force=True)
+    evaluation.correct_predictions = metrics['correct']
+    evaluation.total_predictions = metrics['total']
+    evaluation.accuracy = metrics['accuracy']
+    evaluation.frame_count = run.done
+    evaluation.metrics = json.dumps(metrics_to_json(metrics), ensure_ascii=False)
+    evaluation.state = 'succeeded'
+    evaluation.progress = 100
+    evaluation.finished_at = datetime.utcnow()
+    db.session.commit()
+    log.info("评估完成: 评估帧数=%d, 有标注帧数=%d, 准确率=%.4f", run.done, metrics['total'], metrics['accuracy'])
+
+
+def _confidence(value):
+    """置信度保存为float，sklearn模型不支持概率时为None"""
+    value = float(value)
+    return None if value != value else value
+
+
+def recover_evaluations():
+    """服务启动时把未完成的评估标记为失败（评估线程随Web进程退出）"""
+    # 训练进程导入app时也会执行到这里，只在Web进程中检查
+    if multiprocessing.parent_process() is not None:
+        return
+    evaluations = Evaluation.query.filter(Evaluation.state.in_(ACTIVE_STATES)).all()
+    for evaluation in evaluations:
+        evaluation.state = 'failed'
+        evaluation.error = '服务重启，评估未完成'
+        evaluation.finished_at = datetime.utcnow()
+    if evaluations:
+        db.session.commit()
+        logger.warning("%d 个未完成的评估已标记为失败", len(evaluations))
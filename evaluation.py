@@ -0,0 +1,112 @@
+"""模型评估
+
+评估按批进行：每批帧先从特征缓存读取特征（未缓存的帧才解码和计算），再用一次批量预测得到整批的行为；
+全部帧预测完成后，用混淆矩阵一次计算各行为的出现次数、精确率和召回率。
+每帧的预测结果保存在FramePrediction表中（见repository），该模块不依赖Flask。
+"""
+import numpy as np
+
+from feature_store import get_frame_features
+from linear_inference import predict_labels
+
+# 默认每批评估的帧数
+DEFAULT_BATCH_SIZE = 256
+
+
+def predict_frame_batches(bundle, file_id, frame_indices, extractor, batch_size=DEFAULT_BATCH_SIZE, workers=1):
+    """
+    按批读取视频帧的特征并预测
+    :param bundle: 模型文件内容（见model_cache.ModelCache.get）
+    :param frame_indices: 按顺序评估的帧编号
+    :param workers: 解码和计算未缓存特征的线程数
+    :return: 生成器，每批一项 (有效帧在frame_indices中的下标, 有效帧的预测行为, 置信度)，读取失败的帧不参与预测
+    """
+    for start in range(0, len(frame_indices), batch_size):
+        batch = frame_indices[start:start + batch_size]
+        features, valid = get_frame_features(file_id, batch, extractor, workers)
+        positions = np.flatnonzero(valid)
+        if len(positions):
+            predicted, confidence = predict_labels(bundle, features[valid], return_confidence=True)
+        else:
+            predicted, confidence = np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+        yield positions + start, predicted, confidence
+
+
+def evaluation_metrics(predicted, true, labels=()):
+    """
+    计算评估指标
+    :param predicted: 每帧的预测行为
+    :param true: 每帧的标注行为，没有标注的帧为None
+    :param labels: 结果中包含的行为（例如全部已定义的行为），出现在预测或标注中的其他行为追加在后面
+    :return: {'labels', 'counts': 各行为的预测次数, 'confusion': 有标注的帧的混淆矩阵（行为标注的行为、列为预测的行为）,
+              'precision', 'recall', 'predicted_totals': 有标注的帧中各行为的预测次数,
+              'support': 各行为的标注次数, 'correct', 'total': 有标注的帧数, 'accuracy'}
+             按行为的数组与labels的顺序一致
+    """
+    predicted = np.asarray(predicted, dtype=object)
+    true = np.asarray(true, dtype=object)
+    annotated = true != None  # 逐元素比较，得到有标注的帧
+    labels = list(labels)
+    known = set(labels)
+    extra = (set(predicted.tolist()) | set(true[annotated].tolist())) - known
+    labels += sorted(extra)
+    n = len(labels)
+
+    lookup = np.asarray(labels, dtype=object)
+    order = np.argsort(lookup.astype(str), kind='stable')
+    sorted_labels = lookup[order].astype(str)
+
+    def encode(values):
+        return order[np.searchsorted(sorted_labels, np.asarray(values, dtype=str))] if len(values) else \
+            np.empty(0, dtype=np.int64)
+
+    predicted_codes = encode(predicted)
+    counts = np.bincount(predicted_codes, minlength=n)
+    true_codes = encode(true[annotated])
+    confusion = np.bincount(true_codes * n + predicted_codes[annotated], minlength=n * n).reshape(n, n)
+
+    correct = np.diag(confusion)
+    predicted_totals = confusion.sum(axis=0)
+    support = confusion.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted_totals > 0, correct / predicted_totals, 0.0)
+        recall = np.where(support > 0, correct / support, 0.0)
+    total = int(annotated.sum())
+    return {
+        'labels': labels,
+        'counts': counts,
+        'confusion': confusion,
+        'precision': precision,
+        'recall': recall,
+        'predicted_totals': predicted_totals,
+        'support': support,
+        'correct': int(correct.sum()),
+        'total': total,
+        'accuracy': float(correct.sum() / total) if total else 0.0
+    }
+
+
+def metrics_to_json(metrics):
+    """把evaluation_metrics的结果转换为可以保存为JSON的字典"""
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in metrics.items()}
+
+
+def behavior_stats(metrics):
+    """
+    结果页面的各行为统计
+    :param metrics: evaluation_metrics的结果（或metrics_to_json转换后的字典）
+    :return: (各行为的预测次数, 各行为的指标)；指标中accuracy为预测为该行为的有标注帧中预测正确的比例（精确率），
+             recall为该行为的标注帧中被正确识别的比例
+    """
+    counts = {}
+    stats = {}
+    for i, label in enumerate(metrics['labels']):
+        counts[label] = int(metrics['counts'][i])
+        stats[label] = {
+            'correct': int(metrics['confusion'][i][i]),
+            'total': int(metrics['predicted_totals'][i]),
+            'accuracy': float(metrics['precision'][i]),
+            'support': int(metrics['support'][i]),
+            'recall': float(metrics['recall'][i])
+        }
+    return counts, stats
@@ -0,0 +1,299 @@
+"""帧特征缓存
+
+每个数据文件、每个特征提取器（名称+版本）一个特征矩阵 ``features/<id>/<extractor>.npy``，
+第i行为第i帧的特征，通过np.memmap按需读写；``<extractor>.mask.npy`` 记录已经计算的行，
+``<extractor>.json`` 记录特征来源的版本（帧存储的版本或图片文件的修改时间和大小）。
+
+特征在第一次用到时计算并写入，之后的训练和评估直接读取，不再解码图片。
+未缓存的帧可以在线程池中并行解码和计算（cv2的解码和缩放会释放GIL）。
+帧重新提取或图片被替换后来源版本改变，缓存会被整体重建（写入临时文件后原子替换）。
+同一数据文件的缓存由线程锁和 ``features/<id>/.lock`` 文件锁保护（训练进程和Web进程可能同时读写），
+不同数据文件之间互不阻塞。
+训练时按标注数量预分配特征矩阵（FeatureMatrix），超过内存预算时使用 ``features/tmp`` 下的临时内存映射文件。
+该模块不依赖Flask，可以在独立进程中调用。
+"""
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import cv2
+import numpy as np
+
+from features import DEFAULT_EXTRACTOR
+from frame_store import get_frames_dir, get_frames_version, list_frame_indices, read_frame
+
+logger = logging.getLogger(__name__)
+
+FEATURES_ROOT = 'features'
+
+# 超过内存预算的训练特征矩阵写入的目录
+SPILL_DIR = os.path.join(FEATURES_ROOT, 'tmp')
+
+# 每个数据文件一个线程锁：file_id -> threading.Lock，_locks_lock只保护该字典
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_features_dir(file_id):
+    """数据文件的特征缓存目录"""
+    return os.path.join(FEATURES_ROOT, str(file_id))
+
+
+@contextmanager
+def _file_lock(file_id):
+    """
+    独占一个数据文件的特征缓存：先取本进程内的线程锁，再取跨进程的文件锁
+    """
+    key = str(file_id)
+    with _locks_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        features_dir = get_features_dir(key)
+        os.makedirs(features_dir, exist_ok=True)
+        with open(os.path.join(features_dir, '.lock'), 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK重试约10秒后仍失败时抛出，继续等待
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def remove_features(file_id=None):
+    """删除一个数据文件（file_id为None时为全部）的特征缓存"""
+    if file_id is None:
+        if not os.path.exists(FEATURES_ROOT):
+            return
+        for name in os.listdir(FEATURES_ROOT):
+            if name.isdigit():
+                remove_features(name)
+        shutil.rmtree(FEATURES_ROOT, ignore_errors=True)
+        return
+    path = get_features_dir(file_id)
+    if not os.path.exists(path):
+        return
+    with _file_lock(file_id):
+        # 保留锁文件，等待该锁的其他进程仍然锁定同一个文件
+        for name in os.listdir(path):
+            if name == '.lock':
+                continue
+            item_path = os.path.join(path, name)
+            if os.path.isdir(item_path):
+                shutil.rmtree(item_path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(item_path)
+                except OSError:
+                    logger.warning("删除特征缓存失败: %s", item_path)
+
+
+class FeatureCache:
+    """单个数据文件、单个特征提取器的特征矩阵"""
+
+    def __init__(self, features_dir, extractor, rows, source_version):
+        """
+        :param rows: 矩阵行数（帧数）
+        :param source_version: 特征来源的版本，与已缓存的版本不同时重建缓存
+        """
+        self.extractor = extractor
+        prefix = os.path.join(features_dir, extractor.key)
+        self.data_path = f'{prefix}.npy'
+        self.mask_path = f'{prefix}.mask.npy'
+        self.meta_path = f'{prefix}.json'
+
+        meta = {'source_version': source_version, 'rows': rows, 'dim': extractor.dim,
+                'dtype': extractor.dtype.str}
+        if self._read_meta() != meta:
+            if not os.path.exists(features_dir):
+                os.makedirs(features_dir)
+            # 新的矩阵先写入临时文件再原子替换，不截断其他进程可能仍在映射的旧文件；
+            # 元数据最后替换，中途退出时版本不一致，下次重新构建
+            self._create(self.data_path, extractor.dtype, (rows, extractor.dim))
+            self._create(self.mask_path, np.uint8, (rows,))
+            tmp_path = f'{self.meta_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.meta_path)
+        self.data = np.load(self.data_path, mmap_mode='r+')
+        self.mask = np.load(self.mask_path, mmap_mode='r+')
+
+    @staticmethod
+    def _create(path, dtype, shape):
+        """创建全零的.npy文件：写入临时文件后替换path"""
+        tmp_path = f'{path}.tmp'
+        array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+
+    def _read_meta(self):
+        if not (os.path.exists(self.data_path) and os.path.exists(self.mask_path)):
+            return None
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, indices, load_image, workers=1, progress_callback=None):
+        """
+        读取特征，未缓存的行调用load_image解码后计算并写入
+        :param indices: 行号列表
+        :param load_image: load_image(index)返回BGR图像，读取失败时返回None
+        :param workers: 计算未缓存特征的线程数
+        :param progress_callback: 进度回调，参数为(已计算行数, 需要计算的行数)
+        :return: (特征矩阵, 有效行的布尔数组)，无效行的特征为0
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        valid = (indices >= 0) & (indices < len(self.mask))
+        missing = list(dict.fromkeys(int(index) for index in indices[valid] if not self.mask[index]))
+
+        def compute(index):
+            image = load_image(index)
+            return None if image is None else self.extractor(image)
+
+        computed = 0
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 and len(missing) > 1 else None
+        try:
+            # executor.map按提交顺序返回结果，写入在当前线程中进行
+            results = executor.map(compute, missing) if executor is not None else map(compute, missing)
+            for done, (index, row) in enumerate(zip(missing, results), 1):
+                if row is not None:
+                    self.data[index] = row
+                    self.mask[index] = 1
+                    computed += 1
+                if progress_callback is not None:
+                    progress_callback(done, len(missing))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        if computed:
+            # 先写特征再写标记，中途退出时不会留下标记为已计算的空特征
+            self.data.flush()
+            self.mask.flush()
+            logger.debug("计算并缓存特征 %d 行: %s", computed, self.data_path)
+
+        valid[valid] = self.mask[indices[valid]].astype(bool)
+        features = np.zeros((len(indices), self.extractor.dim), dtype=self.extractor.dtype)
+        features[valid] = self.data[indices[valid]]
+        return features, valid
+
+
+def get_frame_features(file_id, frame_indices, extractor=DEFAULT_EXTRACTOR, workers=1, progress_callback=None):
+    """
+    获取视频帧的特征
+    :param frame_indices: 帧编号列表
+    :param workers: 解码和计算未缓存特征的线程数
+    :param progress_callback: 进度回调，见FeatureCache.get
+    :return: (特征矩阵, 有效行的布尔数组)，帧不存在或读取失败的行无效
+    """
+    frames_dir = get_frames_dir(file_id)
+    version = get_frames_version(frames_dir)
+    indices = list_frame_indices(frames_dir)
+    if version is None or not indices:
+        return np.zeros((len(frame_indices), extractor.dim), dtype=extractor.dtype), \
+            np.zeros(len(frame_indices), dtype=bool)
+
+    with _file_lock(file_id):
+        cache = FeatureCache(get_features_dir(file_id), extractor, indices[-1] + 1, version)
+        return cache.get(frame_indices, lambda index: read_frame(frames_dir, index), workers, progress_callback)
+
+
+def get_image_features(file_id, image_path, extractor=DEFAULT_EXTRACTOR):
+    """
+    获取图片文件的特征
+    :return: 一维特征向量，图片不存在或读取失败时返回None
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    version = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+    with _file_lock(file_id):
+        cache = FeatureCache(get_features_dir(file_id), extractor, 1, version)
+        features, valid = cache.get([0], lambda index: cv2.imread(image_path))
+    return features[0] if valid[0] else None
+
+
+class FeatureMatrix:
+    """
+    训练用的特征矩阵：按最大行数一次分配，特征按行写入，不经过Python列表
+    数据类型与特征提取器一致（uint8像素或float32描述子），不会转换为float64
+    :param rows: 最大行数（标注数量）
+    :param extractor: 特征提取器
+    :param memory_budget: 内存预算（字节），矩阵超过预算时使用磁盘上的内存映射文件，为None时不限制
+    :param spill_dir: 内存映射文件所在的目录
+    """
+
+    def __init__(self, rows, extractor, memory_budget=None, spill_dir=SPILL_DIR):
+        self.path = None
+        shape = (rows, extractor.dim)
+        if memory_budget is not None and rows * extractor.nbytes > memory_budget:
+            os.makedirs(spill_dir, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(prefix='train_', suffix='.npy', dir=spill_dir)
+            os.close(fd)
+            self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=extractor.dtype, shape=shape)
+            logger.info("特征矩阵 %.1fMB 超过内存预算，写入 %s", rows * extractor.nbytes / 2 ** 20, self.path)
+        else:
+            self.data = np.empty(shape, dtype=extractor.dtype)
+        self.count = 0
+        self.labels = []
+
+    @property
+    def spilled(self):
+        """是否使用磁盘上的内存映射文件"""
+        return self.path is not None
+
+    @property
+    def X(self):
+        """已写入的行"""
+        return self.data[:self.count]
+
+    def append(self, row, label):
+        self.data[self.count] = row
+        self.labels.append(label)
+        self.count += 1
+
+    def close(self):
+        """释放矩阵并删除内存映射文件"""
+        self.data = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                logger.warning("删除临时特征矩阵失败: %s", self.path)
+            self.path = None
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,173 @@
+"""帧特征提取
+
+训练和评估使用同一个特征提取器，特征提取器的名称和版本一起作为特征缓存的键（见feature_store），
+修改提取方法时需要增加版本号，使已缓存的特征失效。
+
+已注册的特征提取器（维数）：
+
+- raw64：64x64的BGR像素（12288），早期模型使用
+- gray32：32x32的灰度像素（1024）
+- hog：64x64灰度图的HOG描述子（1764）
+- color_hist：HSV颜色直方图（128）
+- hog_color：HOG与颜色直方图拼接（1892）
+
+训练时使用的特征提取器保存在模型文件中，评估时按模型文件选择。
+"""
+import time
+
+import cv2
+import numpy as np
+
+
+class FeatureExtractor:
+    """
+    特征提取器：把BGR图像转换为定长的一维特征向量
+    :param name: 名称
+    :param version: 版本号，提取方法变化时递增
+    :param dim: 特征维数
+    :param dtype: 特征的数据类型
+    :param func: 提取函数，参数为BGR图像，返回一维数组
+    :param description: 说明
+    """
+
+    def __init__(self, name, version, dim, dtype, func, description=''):
+        self.name = name
+        self.version = version
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.func = func
+        self.description = description
+
+    @property
+    def key(self):
+        """特征缓存和模型文件中使用的键"""
+        return f'{self.name}_v{self.version}'
+
+    @property
+    def nbytes(self):
+        """每帧特征占用的字节数"""
+        return self.dim * self.dtype.itemsize
+
+    def __call__(self, image):
+        return np.asarray(self.func(image), dtype=self.dtype).reshape(-1)
+
+
+EXTRACTORS = {}
+
+
+def register_extractor(extractor):
+    EXTRACTORS[extractor.name] = extractor
+    return extractor
+
+
+def get_extractor(name):
+    """
+    按名称或键（name_vN）获取特征提取器
+    :raises ValueError: 未注册的名称，或版本与当前实现不一致
+    """
+    base, _, version = name.rpartition('_v')
+    if base in EXTRACTORS and version.isdigit():
+        extractor = EXTRACTORS[base]
+        if extractor.version != int(version):
+            raise ValueError(f'特征提取器版本不一致: {name}，当前为{extractor.key}')
+        return extractor
+    if name in EXTRACTORS:
+        return EXTRACTORS[name]
+    raise ValueError(f'未知的特征提取器: {name}')
+
+
+def _gray(image, size):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def _raw_pixels(image):
+    return cv2.resize(image, (64, 64)).reshape(-1)
+
+
+def _gray32(image):
+    return _gray(image, 32).reshape(-1)
+
+
+def _hog(image, cell=8, bins=9):
+    """
+    64x64灰度图的HOG描述子：8x8像素的单元内按梯度方向（0-180度，9个方向，线性插值）统计梯度幅值，
+    2x2单元为一块、步长为1个单元，每块做L2-Hys归一化，共7*7*4*9=1764维
+    （参数与64x64窗口的cv2.HOGDescriptor相同，不依赖OpenCV的objdetect模块，OpenCV 4/5结果一致）
+    """
+    gray = _gray(image, 64).astype(np.float32)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=1)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=1)
+    magnitude, angle = cv2.cartToPolar(gx, gy, angleInDegrees=True)
+
+    # 每个像素的梯度按角度线性分配到相邻的两个方向
+    position = (angle % 180) / (180 / bins) - 0.5
+    low = np.floor(position)
+    weight_high = position - low
+    low = low.astype(np.int64) % bins
+    high = (low + 1) % bins
+
+    cells = gray.shape[0] // cell
+    rows, cols = np.indices(gray.shape)
+    cell_index = (rows // cell) * cells + cols // cell
+    size = cells * cells * bins
+    hist = (np.bincount((cell_index * bins + low).ravel(), (magnitude * (1 - weight_high)).ravel(), size)
+            + np.bincount((cell_index * bins + high).ravel(), (magnitude * weight_high).ravel(), size))
+    hist = hist.reshape(cells, cells, bins)
+
+    blocks = np.lib.stride_tricks.sliding_window_view(hist, (2, 2), axis=(0, 1))
+    blocks = blocks.transpose(0, 1, 3, 4, 2).reshape(cells - 1, cells - 1, 4 * bins)
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=2, keepdims=True) + 1e-6)
+    blocks = np.minimum(blocks, 0.2)
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=2, keepdims=True) + 1e-6)
+    return blocks.reshape(-1)
+
+
+def _color_hist(image):
+    hsv = cv2.cvtColor(cv2.resize(image, (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 4, 4], [0, 180, 0, 256, 0, 256])
+    return cv2.normalize(hist, hist, norm_type=cv2.NORM_L1)
+
+
+def _hog_color(image):
+    return np.concatenate([_hog(image), _color_hist(image).reshape(-1)])
+
+
+RAW_PIXELS = register_extractor(FeatureExtractor(
+    'raw64', 1, 64 * 64 * 3, np.uint8, _raw_pixels, '64x64 BGR像素'))
+register_extractor(FeatureExtractor(
+    'gray32', 1, 32 * 32, np.uint8, _gray32, '32x32灰度像素'))
+register_extractor(FeatureExtractor(
+    'hog', 1, 1764, np.float32, _hog, '64x64灰度图的HOG描述子'))
+register_extractor(FeatureExtractor(
+    'color_hist', 1, 8 * 4 * 4, np.float32, _color_hist, 'HSV颜色直方图(8x4x4)'))
+register_extractor(FeatureExtractor(
+    'hog_color', 1, 1764 + 8 * 4 * 4, np.float32, _hog_color, 'HOG + HSV颜色直方图'))
+
+# 模型文件中没有记录特征提取器时（早期模型）使用
+DEFAULT_EXTRACTOR = RAW_PIXELS
+
+
+def benchmark_extractors(images, extractors=None):
+    """
+    统计各特征提取器的特征大小和提取耗时
+    :param images: BGR图像列表
+    :param extractors: 特征提取器列表，默认为全部已注册的
+    :return: 每个提取器一项 {'name', 'key', 'dim', 'bytes', 'ms_per_frame', 'description'}
+    """
+    report = []
+    for extractor in extractors or EXTRACTORS.values():
+        start = time.perf_counter()
+        for image in images:
+            extractor(image)
+        elapsed = time.perf_counter() - start
+        report.append({
+            'name': extractor.name,
+            'key': extractor.key,
+            'dim': extractor.dim,
+            'bytes': extractor.nbytes,
+            'ms_per_frame': 1000 * elapsed / len(images) if images else 0.0,
+            'description': extractor.description
+        })
+    return report
@@ -0,0 +1,494 @@
+"""视频帧打包存储
+
+每个视频的帧保存为一个打包文件 ``static/frames/<id>/frames.pack``，代替成百上千个
+``frame_XXXX.jpg`` 小文件。文件格式（小端）::
+
+    头部    magic 'TBFP' | version u16 | reserved u16
+    数据    依次存放的JPEG编码帧
+    索引    每帧一项：offset u64 | length u32
+    尾部    count u32 | index_offset u64 | magic 'TBFP'
+
+索引放在文件末尾，提取时可以边解码边写入；读取时通过mmap映射文件，
+按帧编号直接定位索引项，随机访问任意一帧都是O(1)，不需要listdir和逐个open。
+
+除原始帧外，提取时还可以写入缩小的预览图（``frames.thumb.pack``、``frames.medium.pack``），
+各打包文件中的帧编号一一对应，页面按显示尺寸选择最小的合适版本。
+
+早期版本提取的目录中只有 ``frame_XXXX.jpg``，读取函数会自动回退到这些文件。
+该模块不依赖Flask，可以在独立进程中调用。
+"""
+import io
+import os
+import mmap
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+PACK_MAGIC = b'TBFP'
+PACK_VERSION = 1
+PACK_FILENAME = 'frames.pack'
+# 帧的各级尺寸，full为原始帧
+FRAME_VARIANTS = ('full', 'medium', 'thumb')
+
+_HEADER = struct.Struct('<4sHH')
+_INDEX_ENTRY = struct.Struct('<QI')
+_FOOTER = struct.Struct('<IQ4s')
+
+# 每个进程最多同时保持映射的打包文件数量
+_OPEN_PACKS_LIMIT = 32
+
+# 预览图规格：variant为medium或thumb，max_size为最长边像素，ext为.jpg或.webp，quality为1-100
+PreviewSpec = namedtuple('PreviewSpec', ['variant', 'max_size', 'ext', 'quality'])
+
+
+def get_frames_dir(file_id):
+    """视频帧保存目录（使用文件ID作为目录名，避免中文路径问题）"""
+    return os.path.join('static', 'frames', str(file_id))
+
+
+def get_pack_path(frames_dir, variant='full'):
+    if variant == 'full':
+        return os.path.join(frames_dir, PACK_FILENAME)
+    return os.path.join(frames_dir, f'frames.{variant}.pack')
+
+
+def encode_params(ext, quality):
+    """cv2.imencode的质量参数"""
+    if ext == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+
+
+def resize_to_fit(image, max_size):
+    """按比例缩小到最长边不超过max_size，不放大"""
+    height, width = image.shape[:2]
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def guess_mimetype(data):
+    """根据编码数据的文件头判断图片类型"""
+    head = bytes(data[:12])
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    return 'image/jpeg'
+
+
+class FramePackWriter:
+    """
+    顺序写入打包文件，先写入临时文件，close时写入索引并原子替换目标文件
+
+    用法::
+
+        with FramePackWriter(path) as writer:
+            writer.append(jpeg_bytes)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f'{path}.tmp'
+        self._file = open(self.tmp_path, 'wb')
+        self._file.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0))
+        self._offset = _HEADER.size
+        self._index = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def append(self, data):
+        """追加一帧已编码的图像，返回该帧在包内的编号"""
+        self._file.write(data)
+        self._index.append((self._offset, len(data)))
+        self._offset += len(data)
+        return len(self._index) - 1
+
+    def append_image(self, image, ext='.jpg', params=None):
+        """编码并追加一帧图像，编码失败时返回None"""
+        ok, buffer = cv2.imencode(ext, image, params or [])
+        if not ok:
+            return None
+        return self.append(buffer.tobytes())
+
+    def close(self):
+        if self._file is None:
+            return
+        index_offset = self._offset
+        for offset, length in self._index:
+            self._file.write(_INDEX_ENTRY.pack(offset, length))
+        self._file.write(_FOOTER.pack(len(self._index), index_offset, PACK_MAGIC))
+        self._file.close()
+        self._file = None
+        # 先释放本进程对旧文件的映射，Windows上被映射的文件不能替换
+        close_packs(os.path.dirname(self.path))
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """放弃写入并删除临时文件"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def remove_stale_variants(frames_dir, variants):
+    """删除上次提取遗留的、本次未生成的预览图，避免与新的原始帧错位"""
+    for variant in FRAME_VARIANTS:
+        stale_path = get_pack_path(frames_dir, variant)
+        if variant not in variants and os.path.exists(stale_path):
+            close_packs(frames_dir)
+            os.remove(stale_path)
+
+
+class FrameSetWriter:
+    """
+    同时写入原始帧和各级预览图的打包文件，保证各打包文件中的帧编号一致
+
+    用法::
+
+        with FrameSetWriter(frames_dir, previews) as writer:
+            writer.append_image(frame)
+    """
+
+    def __init__(self, frames_dir, previews=(), suffix=''):
+        """
+        :param previews: PreviewSpec列表
+        :param suffix: 打包文件名后缀，并行提取时各段使用 .partNN
+        """
+        self.frames_dir = frames_dir
+        self.previews = list(previews)
+        self.suffix = suffix
+        self._writers = {'full': FramePackWriter(get_pack_path(frames_dir) + suffix)}
+        for spec in self.previews:
+            self._writers[spec.variant] = FramePackWriter(get_pack_path(frames_dir, spec.variant) + suffix)
+
+    @property
+    def variants(self):
+        return list(self._writers)
+
+    def __len__(self):
+        return len(self._writers['full'])
+
+    def append_image(self, image, ext='.jpg', params=None):
+        """编码并追加一帧及其预览图，原始帧编码失败时返回None"""
+        ok, buffer = cv2.imencode(ext, image, params or [])
+        if not ok:
+            return None
+        data = buffer.tobytes()
+        index = self._writers['full'].append(data)
+        for spec in self.previews:
+            # 原始帧不大于预览尺寸时直接复用原始帧
+            if max(image.shape[:2]) <= spec.max_size and spec.ext == ext:
+                self._writers[spec.variant].append(data)
+                continue
+            ok, preview = cv2.imencode(spec.ext, resize_to_fit(image, spec.max_size),
+                                       encode_params(spec.ext, spec.quality))
+            # 预览图编码失败时写入原始帧，保持帧编号对齐
+            self._writers[spec.variant].append(preview.tobytes() if ok else data)
+        return index
+
+    def close(self):
+        # 最后替换原始帧：帧存储的版本取自原始帧打包文件，版本变化时预览图已经是新的
+        for writer in reversed(list(self._writers.values())):
+            writer.close()
+        if not self.suffix:
+            remove_stale_variants(self.frames_dir, self.variants)
+
+    def abort(self):
+        for writer in self._writers.values():
+            writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class FramePack:
+    """通过mmap只读访问打包文件"""
+
+    def __init__(self, path, file=None):
+        """
+        :param file: 已打开的打包文件，保证映射的就是调用方打开的文件（不会在两次open之间被替换）
+        """
+        self.path = path
+        f = file if file is not None else open(path, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size < _HEADER.size + _FOOTER.size:
+                raise ValueError(f'帧打包文件不完整: {path}')
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            if file is None:
+                f.close()
+
+        size = len(self._mmap)
+        magic, version, _ = _HEADER.unpack_from(self._mmap, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self._mmap.close()
+            raise ValueError(f'不是有效的帧打包文件: {path}')
+        self._count, self._index_offset, magic = _FOOTER.unpack_from(self._mmap, size - _FOOTER.size)
+        # 索引紧接在数据之后、尾部之前，截断或损坏的文件对不上
+        if magic != PACK_MAGIC or self._index_offset < _HEADER.size or \
+                self._index_offset + self._count * _INDEX_ENTRY.size + _FOOTER.size != size:
+            self._mmap.close()
+            raise ValueError(f'帧打包文件不完整: {path}')
+
+    def __len__(self):
+        return self._count
+
+    def get_range(self, index):
+        """第index帧在文件中的(偏移, 长度)"""
+        if index < 0 or index >= self._count:
+            raise IndexError(index)
+        offset, length = _INDEX_ENTRY.unpack_from(self._mmap, self._index_offset + index * _INDEX_ENTRY.size)
+        if offset < _HEADER.size or offset + length > self._index_offset:
+            raise ValueError(f'帧打包文件的索引已损坏: {self.path}')
+        return offset, length
+
+    def get_bytes(self, index):
+        """返回第index帧的编码数据（mmap上的memoryview，不拷贝）"""
+        offset, length = self.get_range(index)
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def read_frame(self, index, flags=cv2.IMREAD_COLOR):
+        """解码第index帧"""
+        return cv2.imdecode(np.frombuffer(self.get_bytes(index), dtype=np.uint8), flags)
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 仍有memoryview引用该映射，交给垃圾回收
+            pass
+
+
+_open_packs = OrderedDict()
+_open_packs_lock = threading.Lock()
+
+
+def open_pack(path, file=None):
+    """
+    打开打包文件，按(路径, 修改时间, 大小)缓存已映射的文件
+    :param file: 已打开的打包文件，按该文件的状态查找缓存
+    :return: FramePack，文件不存在时返回None
+    """
+    try:
+        stat = os.fstat(file.fileno()) if file is not None else os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    with _open_packs_lock:
+        pack = _open_packs.get(key)
+        if pack is not None:
+            _open_packs.move_to_end(key)
+            return pack
+        pack = FramePack(path, file)
+        _open_packs[key] = pack
+        while len(_open_packs) > _OPEN_PACKS_LIMIT:
+            _open_packs.popitem(last=False)[1].close()
+        return pack
+
+
+def close_packs(frames_dir=None):
+    """
+    关闭并移出缓存中frames_dir下的打包文件映射，替换或删除打包文件之前调用
+    :param frames_dir: 帧目录，为None时关闭所有映射
+    """
+    prefix = None if frames_dir is None else os.path.join(os.path.abspath(frames_dir), '')
+    with _open_packs_lock:
+        keys = [key for key in _open_packs if prefix is None or key[0].startswith(prefix)]
+        for key in keys:
+            _open_packs.pop(key).close()
+
+
+def merge_packs(part_paths, path):
+    """
+    按顺序合并多个打包文件，合并后删除各部分
+    :return: 合并后的帧数量
+    """
+    with FramePackWriter(path) as writer:
+        for part_path in part_paths:
+            if not os.path.exists(part_path):
+                continue
+            part = FramePack(part_path)
+            for i in range(len(part)):
+                writer.append(part.get_bytes(i))
+            part.close()
+        count = len(writer)
+    for part_path in part_paths:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return count
+
+
+def _legacy_frame_path(frames_dir, index):
+    return os.path.join(frames_dir, f'frame_{index:04d}.jpg')
+
+
+def get_frames_version(frames_dir):
+    """
+    帧存储的版本标识，由打包文件的修改时间和大小组成，重新提取后改变
+    早期版本的目录没有打包文件，使用目录的修改时间
+    :return: 版本字符串，帧不存在时返回None
+    """
+    for path in (get_pack_path(frames_dir), frames_dir):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+    return None
+
+
+def get_frame_file(frames_dir, index):
+    """
+    早期版本提取的单帧文件路径，帧保存在打包文件中时返回None
+    """
+    if os.path.exists(get_pack_path(frames_dir)):
+        return None
+    legacy_path = _legacy_frame_path(frames_dir, index)
+    return legacy_path if os.path.exists(legacy_path) else None
+
+
+def list_frame_indices(frames_dir):
+    """
+    列出目录中的帧编号
+    :return: 递增的帧编号列表
+    """
+    pack = open_pack(get_pack_path(frames_dir))
+    if pack is not None:
+        return list(range(len(pack)))
+
+    # 兼容早期版本的frame_XXXX.jpg
+    if not os.path.exists(frames_dir):
+        return []
+    indices = []
+    for name in os.listdir(frames_dir):
+        if name.startswith('frame_') and name.endswith('.jpg'):
+            try:
+                indices.append(int(name[len('frame_'):-len('.jpg')]))
+            except ValueError:
+                continue
+    indices.sort()
+    return indices
+
+
+def read_frame_bytes(frames_dir, index, variant='full'):
+    """
+    读取一帧的编码数据
+    :param variant: full/medium/thumb，没有对应的预览图时返回原始帧
+    :return: bytes或memoryview，帧不存在时返回None
+    """
+    pack = None
+    if variant != 'full':
+        pack = open_pack(get_pack_path(frames_dir, variant))
+    if pack is None:
+        pack = open_pack(get_pack_path(frames_dir))
+    if pack is not None:
+        if 0 <= index < len(pack):
+            return pack.get_bytes(index)
+        return None
+
+    legacy_path = _legacy_frame_path(frames_dir, index)
+    if os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            return f.read()
+    return None
+
+
+class FrameFile(io.RawIOBase):
+    """
+    打包文件中一帧的只读文件对象，读取不会超出该帧的数据
+
+    供send_file发送：支持sendfile的WSGI服务器（例如gunicorn）按fileno、当前位置和Content-Length
+    直接从文件发送，其他服务器按块读取，都不需要先把整帧拷贝为bytes。
+    """
+
+    def __init__(self, file, offset, length):
+        self._file = file
+        self._file.seek(offset)
+        self._remaining = length
+        self.length = length
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        count = self._file.readinto(memoryview(buffer)[:size]) or 0
+        self._remaining -= count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_frame_file(frames_dir, index, variant='full'):
+    """
+    打开打包文件中的一帧用于发送
+    :param variant: full/medium/thumb，没有对应的预览图时返回原始帧
+    :return: (FrameFile, mimetype)，没有打包文件、打包文件损坏或帧不存在时返回None
+    """
+    paths = [get_pack_path(frames_dir)]
+    if variant != 'full':
+        paths.insert(0, get_pack_path(frames_dir, variant))
+    for path in paths:
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        # 按已打开的文件查找索引，打包文件在这期间被替换时偏移仍然对应该文件
+        try:
+            pack = open_pack(path, file)
+            if not 0 <= index < len(pack):
+                file.close()
+                return None
+            offset, length = pack.get_range(index)
+        except ValueError:
+            # 打包文件不完整或已损坏：预览图回退到原始帧，原始帧损坏时按帧不存在处理
+            file.close()
+            continue
+        return FrameFile(file, offset, length), guess_mimetype(pack.get_bytes(index)[:12])
+    return None
+
+
+def read_frame(frames_dir, index, flags=cv2.IMREAD_COLOR):
+    """
+    读取并解码一帧
+    :return: BGR图像，帧不存在或解码失败时返回None
+    """
+    data = read_frame_bytes(frames_dir, index)
+    if data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
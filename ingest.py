@@ -0,0 +1,241 @@
+"""视频帧提取任务队列
+
+上传视频后将帧提取任务提交到有界的进程池中执行，避免在标注页面的请求中同步解码视频。
+任务状态写入 ``DataFile.status``（queued → processed / extract_failed），
+提取进度通过进程间共享的字典上报，供标注页面轮询；已标注的文件保持annotated状态，提取失败只记录在进度中。
+任务完成后把帧清单写入 ``Frame`` 表，之后的页面只查询数据库，不再扫描帧目录。
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app, db
+from app_logging import get_job_logger, get_worker_log_queue
+from feature_store import remove_features
+from frame_store import PreviewSpec, close_packs, get_frames_dir, get_pack_path, list_frame_indices
+from models import DataFile, Frame
+from video_frames import run_extraction_job
+
+logger = logging.getLogger(__name__)
+
+# 依次尝试的帧间隔（秒），前一个间隔提取不到帧时使用下一个
+EXTRACT_INTERVALS = (3, 0.5)
+
+_executor = None
+_manager = None
+_progress = None
+_slots = None
+_log_queue = None
+# 正在执行或排队中的任务：data_file_id -> Future
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    """延迟创建进程池和进度字典"""
+    global _executor, _manager, _progress, _slots, _log_queue
+    if _executor is None:
+        # 使用spawn启动子进程，避免在多线程的Web进程中fork
+        ctx = multiprocessing.get_context('spawn')
+        workers = app.config['INGEST_WORKERS']
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        _manager = ctx.Manager()
+        _progress = _manager.dict()
+        # 运行中+排队中的任务总数上限，超过后拒绝新任务（背压）
+        _slots = threading.BoundedSemaphore(workers + app.config['INGEST_MAX_PENDING'])
+        _log_queue = get_worker_log_queue(ctx)
+    return _executor
+
+
+def get_preview_specs():
+    """根据配置生成提取时写入的预览图规格"""
+    ext = '.' + app.config['FRAME_PREVIEW_FORMAT'].lower().lstrip('.').replace('jpeg', 'jpg')
+    quality = app.config['FRAME_PREVIEW_QUALITY']
+    specs = []
+    for variant, key in (('medium', 'FRAME_MEDIUM_SIZE'), ('thumb', 'FRAME_THUMB_SIZE')):
+        if app.config[key] > 0:
+            specs.append(PreviewSpec(variant, app.config[key], ext, quality))
+    return specs
+
+
+def get_sampling_options():
+    """
+    根据配置生成采样参数
+    :return: (帧间隔列表, 采样方式, 场景采样参数)
+    """
+    sampling = app.config['FRAME_SAMPLING']
+    if sampling != 'scene':
+        return EXTRACT_INTERVALS, sampling, None
+    scene_options = {
+        'scene_threshold': app.config['FRAME_SCENE_THRESHOLD'],
+        'scene_min_gap': app.config['FRAME_SCENE_MIN_GAP'],
+        'scene_max_gap': app.config['FRAME_SCENE_MAX_GAP']
+    }
+    return (app.config['FRAME_SCENE_PROBE_INTERVAL'],), sampling, scene_options
+
+
+def resolve_video_path(data_file):
+    """
+    查找数据文件对应的视频路径
+    :return: 存在的视频路径，找不到时返回None
+    """
+    possible_paths = []
+    if os.path.isabs(data_file.filepath):
+        possible_paths.append(data_file.filepath)
+    else:
+        possible_paths.append(os.path.join(os.getcwd(), data_file.filepath))
+    possible_paths.append(os.path.join('static', 'uploads', data_file.filename))
+    possible_paths.append(os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], data_file.filename)))
+
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def is_extracting(file_id):
+    """该文件是否有正在执行或排队中的提取任务"""
+    with _lock:
+        return file_id in _jobs
+
+
+def get_extraction_progress(file_id):
+    """
+    获取提取进度
+    :return: {'state', 'done', 'total', 'error'}，本进程中没有该文件的任务时返回None
+    """
+    if _progress is None:
+        return None
+    progress = _progress.get(file_id)
+    return dict(progress) if progress is not None else None
+
+
+def enqueue_extraction(data_file, timeout=0):
+    """
+    提交视频帧提取任务
+    :param data_file: 视频类型的DataFile
+    :param timeout: 队列已满时等待空位的秒数
+    :return: 是否已提交（或已在队列中）
+    """
+    file_id = data_file.id
+    with _lock:
+        if file_id in _jobs:
+            return True
+        executor = _get_executor()
+
+    # 等待空位时不能持有_lock，任务结束的回调需要先取得_lock才能释放空位
+    if not _slots.acquire(timeout=timeout):
+        logger.warning("帧提取队列已满，未提交任务: file_id=%s", file_id)
+        return False
+
+    with _lock:
+        # 等待期间其他请求可能已提交了该文件的任务
+        if file_id in _jobs:
+            _slots.release()
+            return True
+
+        video_path = resolve_video_path(data_file)
+        if video_path is None:
+            logger.error("找不到视频文件，未提交任务: file_id=%s, %s", file_id, data_file.filepath)
+            _slots.release()
+            if data_file.status != 'annotated':
+                data_file.status = 'extract_failed'
+                db.session.commit()
+            _progress[file_id] = {'state': 'failed', 'done': 0, 'total': 0,
+                                  'error': f'视频文件不存在: {data_file.filename}'}
+            return False
+
+        # 先更新状态再提交，避免任务完成的回调被覆盖；已标注的文件保持annotated状态
+        if data_file.status != 'annotated':
+            data_file.status = 'queued'
+            db.session.commit()
+        _progress[file_id] = {'state': 'queued', 'done': 0, 'total': 0, 'error': None}
+        intervals, sampling, scene_options = get_sampling_options()
+        # 提取进程会替换打包文件，先释放Web进程对旧文件的映射
+        close_packs(get_frames_dir(file_id))
+        future = executor.submit(run_extraction_job, file_id, video_path, get_frames_dir(file_id),
+                                 intervals, app.config['FRAME_EXTRACT_STRATEGY'], _progress,
+                                 _log_queue, app.config['LOG_LEVEL'], app.config['FRAME_EXTRACT_WORKERS'],
+                                 get_preview_specs(), sampling, scene_options)
+        _jobs[file_id] = future
+        get_job_logger(__name__, file_id=file_id).info("已提交帧提取任务: %s", video_path)
+
+    future.add_done_callback(lambda f: _on_job_done(file_id, f))
+    return True
+
+
+def _on_job_done(file_id, future):
+    """任务结束后写入帧清单、更新数据文件状态并释放队列空位"""
+    log = get_job_logger(__name__, file_id=file_id)
+    try:
+        manifest = future.result()
+        error = None
+    except Exception as e:
+        manifest = []
+        error = str(e)
+
+    try:
+        # 提取进程异常退出时进度停留在运行中，这里记录失败，标注页面据此不再自动重新提交
+        if not manifest and _progress.get(file_id, {}).get('state') != 'failed':
+            _progress[file_id] = {'state': 'failed', 'done': 0, 'total': 0,
+                                  'error': error or '未能从视频中提取到帧'}
+        with app.app_context():
+            data_file = db.session.get(DataFile, file_id)
+            if data_file is None:
+                return
+            # 提取失败时帧存储没有被替换，保留原有的帧清单；重新提取后旧的特征缓存不再有效
+            if manifest:
+                save_frame_manifest(file_id, manifest, commit=False)
+                remove_features(file_id)
+                close_packs(get_frames_dir(file_id))
+            # 已标注的文件保持annotated状态
+            if data_file.status != 'annotated':
+                data_file.status = 'processed' if manifest else 'extract_failed'
+            db.session.commit()
+        if error:
+            log.error("视频帧提取失败: %s", error)
+        else:
+            log.info("帧提取任务结束，共提取 %d 帧", len(manifest))
+    except Exception:
+        log.exception("更新提取状态失败")
+    finally:
+        # 帧清单写入之后才从任务列表中移除，标注页面轮询到任务结束时即可查询到帧
+        with _lock:
+            _jobs.pop(file_id, None)
+        _slots.release()
+
+
+def save_frame_manifest(file_id, manifest, commit=True):
+    """
+    用新的帧清单替换数据文件原有的Frame记录
+    :param manifest: extract_video_frames返回的帧清单
+    :param commit: 是否立即提交事务
+    """
+    Frame.query.filter_by(data_file_id=file_id).delete()
+    db.session.bulk_insert_mappings(Frame, [dict(record, data_file_id=file_id) for record in manifest])
+    if commit:
+        db.session.commit()
+
+
+def ensure_frame_manifest(data_file):
+    """
+    为早期版本提取的帧（只有帧文件，没有Frame记录）补建帧清单，原视频中的帧编号和时间未知
+    :return: 帧数量
+    """
+    count = Frame.query.filter_by(data_file_id=data_file.id).count()
+    if count:
+        return count
+    frames_dir = get_frames_dir(data_file.id)
+    indices = list_frame_indices(frames_dir)
+    if indices:
+        pack_path = get_pack_path(frames_dir)
+        if os.path.exists(pack_path):
+            paths = [pack_path] * len(indices)
+        else:
+            paths = [os.path.join(frames_dir, f'frame_{index:04d}.jpg') for index in indices]
+        save_frame_manifest(data_file.id, [{'frame_index': index, 'path': path}
+                                           for index, path in zip(indices, paths)])
+        logger.info("已为早期提取的帧补建清单: file_id=%s, %d 帧", data_file.id, len(indices))
+    return len(indices)
@@ -0,0 +1,220 @@
+"""线性模型的快速推理
+
+训练得到的两种分类器都是线性模型：线性核SVC（一对一，每对类别一个超平面）和
+StandardScaler + SGDClassifier（一对多，标准化可以合并到权重中）。
+export_linear把它们转换为float32的权重矩阵W、偏置b和标签表，
+推理时每批特征只需要一次矩阵乘法，不经过sklearn逐次调用的参数检查。
+
+导出结果与模型文件保存在一起（``<模型文件>.linear.npz``，见training.save_bundle），
+早期没有导出文件的模型在加载时从模型文件中转换。该模块不依赖Flask。
+"""
+import os
+import time
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+
+# 推理时每批转换为float32的样本数
+BATCH_SIZE = 1024
+
+
+class LinearModel:
+    """
+    导出的线性模型
+    :param W: 权重矩阵，(超平面数, 特征维数)
+    :param b: 偏置，(超平面数,)
+    :param labels: 类别对应的行为标签
+    :param scheme: ovo（一对一投票，SVC）或ovr（一对多取最大值，SGD）；只有两个类别时为一个超平面，大于0为第二个类别
+    """
+
+    def __init__(self, W, b, labels, scheme):
+        self.W = np.ascontiguousarray(W, dtype=np.float32)
+        self.b = np.asarray(b, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.scheme = scheme
+        n_classes = len(self.labels)
+        if n_classes > 2 and scheme == 'ovo':
+            # 第p个超平面区分类别pairs[p][0]（大于0）和pairs[p][1]，顺序与libsvm一致
+            self._pairs = np.array([(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)])
+        else:
+            self._pairs = None
+
+    def decision_function(self, X):
+        """各超平面的决策值，(样本数, 超平面数)"""
+        return np.asarray(X, dtype=np.float32) @ self.W.T + self.b
+
+    def _predict_batch(self, X):
+        """
+        :return: (类别编号, 置信度)；置信度由决策值经sigmoid换算：一对多为各类别归一化后的概率
+                 （与SGDClassifier(log_loss).predict_proba一致），一对一为各类别所在超平面的概率之和归一化，
+                 用于排序和筛选，不是校准过的概率
+        """
+        scores = self.decision_function(X)
+        sigmoid = 1 / (1 + np.exp(-np.clip(scores, -30, 30)))
+        rows = np.arange(len(scores))
+        if len(self.labels) == 2:
+            predicted = (scores[:, 0] > 0).astype(np.intp)
+            return predicted, np.where(predicted == 1, sigmoid[:, 0], 1 - sigmoid[:, 0])
+        if self._pairs is None:
+            predicted = scores.argmax(axis=1)
+            return predicted, sigmoid[rows, predicted] / sigmoid.sum(axis=1)
+        # 一对一投票，票数相同时取编号小的类别（与libsvm一致）
+        positive = scores > 0
+        votes = np.zeros((len(scores), len(self.labels)), dtype=np.int32)
+        support = np.zeros((len(scores), len(self.labels)), dtype=np.float32)
+        for p, (i, j) in enumerate(self._pairs):
+            votes[:, i] += positive[:, p]
+            votes[:, j] += ~positive[:, p]
+            support[:, i] += sigmoid[:, p]
+            support[:, j] += 1 - sigmoid[:, p]
+        predicted = votes.argmax(axis=1)
+        return predicted, support[rows, predicted] / len(self._pairs)
+
+    def _batches(self, X):
+        for start in range(0, len(X), BATCH_SIZE):
+            yield self._predict_batch(X[start:start + BATCH_SIZE])
+
+    def predict(self, X):
+        """
+        按批预测
+        :param X: 特征矩阵（uint8/float32均可）
+        :return: 类别编号（labels的下标）
+        """
+        return self.predict_confidence(X)[0]
+
+    def predict_confidence(self, X):
+        """
+        按批预测
+        :return: (类别编号, 置信度)，置信度见_predict_batch
+        """
+        if not len(X):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        predicted, confidence = zip(*self._batches(X))
+        return np.concatenate(predicted), np.concatenate(confidence)
+
+    def predict_labels(self, X):
+        """按批预测并返回行为标签"""
+        return self.labels[self.predict(X)]
+
+    def save(self, path):
+        """写入临时文件后替换，读取时不会读到写了一半的文件"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, W=self.W, b=self.b, labels=self.labels.astype(str), scheme=self.scheme)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['W'], data['b'], data['labels'], str(data['scheme']))
+
+
+def linear_path(model_path):
+    """导出文件的路径，与模型文件在同一目录"""
+    return f'{os.path.splitext(model_path)[0]}.linear.npz'
+
+
+def export_linear(model, label_encoder):
+    """
+    把模型转换为LinearModel
+    :return: LinearModel，模型不是线性模型时返回None
+    """
+    if isinstance(model, SVC):
+        if model.kernel != 'linear':
+            return None
+        W, b, scheme = model.coef_, model.intercept_, 'ovo'
+    elif (isinstance(model, Pipeline) and set(model.named_steps) == {'scaler', 'clf'}
+          and hasattr(model.named_steps['clf'], 'coef_')):
+        scaler = model.named_steps['scaler']
+        clf = model.named_steps['clf']
+        # (x - mean) / scale 合并到权重和偏置中
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(clf.coef_.shape[1])
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(clf.coef_.shape[1])
+        W = clf.coef_ / scale
+        b = clf.intercept_ - W @ mean
+        scheme = 'ovr'
+    else:
+        return None
+    classes = model.classes_
+    return LinearModel(W, b, label_encoder.inverse_transform(classes), scheme)
+
+
+def load_linear(model_path, bundle):
+    """
+    加载模型的导出文件，没有导出文件（早期的模型）时从模型文件内容转换
+    :param bundle: 模型文件内容
+    :return: LinearModel，不是线性模型时返回None
+    """
+    path = linear_path(model_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(model_path):
+        return LinearModel.load(path)
+    return export_linear(bundle['model'], bundle['label_encoder'])
+
+
+def predict_labels(bundle, X, return_confidence=False):
+    """
+    预测行为标签，有导出的线性模型时使用矩阵乘法，否则使用sklearn模型
+    :param bundle: 模型文件内容（见model_cache.ModelCache.get）
+    :param X: 特征矩阵
+    :param return_confidence: 同时返回每个预测的置信度（见LinearModel._predict_batch），
+                              sklearn模型使用predict_proba，不支持时置信度为NaN
+    :return: 行为标签，或(行为标签, 置信度)
+    """
+    linear = bundle.get('linear')
+    if linear is not None:
+        if not return_confidence:
+            return linear.predict_labels(X)
+        predicted, confidence = linear.predict_confidence(X)
+        return linear.labels[predicted], confidence
+    model = bundle['model']
+    encoded = model.predict(X)
+    labels = bundle['label_encoder'].inverse_transform(encoded)
+    if not return_confidence:
+        return labels
+    if hasattr(model, 'predict_proba') and len(X):
+        probabilities = model.predict_proba(X)
+        columns = np.searchsorted(model.classes_, encoded)
+        return labels, probabilities[np.arange(len(X)), columns]
+    return labels, np.full(len(X), np.nan, dtype=np.float32)
+
+
+def benchmark_inference(bundle, linear, X, repeats=3):
+    """
+    比较sklearn逐帧预测、sklearn整批预测和导出的线性模型整批预测的耗时
+    :param X: 特征矩阵
+    :return: [{'name', 'ms_per_frame', 'agreement'}, ...]，agreement为与sklearn逐帧预测结果一致的比例，
+             导出正确时都为1
+    """
+    model = bundle['model']
+    label_encoder = bundle['label_encoder']
+
+    def sklearn_single():
+        return label_encoder.inverse_transform(np.concatenate([model.predict(row.reshape(1, -1)) for row in X]))
+
+    def sklearn_batch():
+        return label_encoder.inverse_transform(model.predict(X))
+
+    candidates = [('sklearn（逐帧）', sklearn_single), ('sklearn（整批）', sklearn_batch)]
+    if linear is not None:
+        # 经过predict_labels（与评估、分析和实时识别的调用方式相同），一致率同时是导出结果的正确性检查
+        linear_bundle = dict(bundle, linear=linear)
+        candidates.append(('线性模型（整批）', lambda: predict_labels(linear_bundle, X)))
+
+    reference = None
+    results = []
+    for name, func in candidates:
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predicted = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if reference is None:
+            reference = predicted
+        results.append({
+            'name': name,
+            'ms_per_frame': best * 1000 / max(len(X), 1),
+            'agreement': float(np.mean(predicted == reference)) if len(X) else 1.0
+        })
+    return results
@@ -0,0 +1,134 @@
+"""进程内的模型缓存
+
+评估等请求通过load_model获取模型文件内容，不再每次从磁盘joblib.load。
+缓存按模型ID索引，并记录模型文件的修改时间，文件被替换后重新加载；
+缓存的模型文件总大小超过 ``MODEL_CACHE_MB`` 时淘汰最久未使用的模型。
+
+模型文件中的numpy数组（例如SVM的支持向量）以写时复制的内存映射加载，
+多个Web进程加载同一个模型时共享操作系统的页缓存，不会各自复制一份。
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+import joblib
+
+from app import app
+from linear_inference import load_linear
+from models import Model
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCache:
+    """
+    按最近使用顺序淘汰的模型缓存（线程安全）
+    :param memory_budget: 缓存的模型文件总大小上限（字节），最近使用的一个模型总是保留
+    """
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        # model_id -> (文件修改时间, 文件大小, 模型文件内容)，按使用顺序排列，最后一项最近使用
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_id, path):
+        """
+        获取模型文件内容，未缓存或文件已变化时从磁盘加载
+        :return: 模型文件内容（见training.save_bundle），linear为导出的线性模型（不是线性模型时为None）
+        """
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(model_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # 在锁外加载，加载大模型时不阻塞其他模型的请求
+        bundle = joblib.load(path, mmap_mode='c')
+        # 线性模型的导出结果（见linear_inference），评估时用矩阵乘法批量预测
+        bundle['linear'] = load_linear(path, bundle)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._entries[model_id] = (mtime, size, bundle)
+            self._entries.move_to_end(model_id)
+            self._evict()
+        logger.info("加载模型 %s 到缓存: %s (%.1fMB)", model_id, path, size / 2 ** 20)
+        return bundle
+
+    def _evict(self):
+        total = sum(entry[1] for entry in self._entries.values())
+        while total > self.memory_budget and len(self._entries) > 1:
+            model_id, (_, size, _) = self._entries.popitem(last=False)
+            total -= size
+            logger.info("模型 %s 超出缓存预算，已从缓存移除", model_id)
+
+    def discard(self, model_id=None):
+        """移除一个模型（model_id为None时为全部）"""
+        with self._lock:
+            if model_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(model_id, None)
+
+    def stats(self):
+        """缓存的模型ID、总大小和命中次数"""
+        with self._lock:
+            return {
+                'models': list(self._entries),
+                'size_mb': sum(entry[1] for entry in self._entries.values()) / 2 ** 20,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_model_cache():
+    """进程内唯一的模型缓存，第一次使用时按配置创建"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ModelCache(app.config['MODEL_CACHE_MB'] * 2 ** 20)
+        return _cache
+
+
+def load_model(model):
+    """
+    通过缓存加载模型文件
+    :param model: Model记录
+    :return: 模型文件内容
+    """
+    return get_model_cache().get(model.id, model.model_path)
+
+
+def discard_model(model_id=None):
+    """模型被删除后从缓存中移除（model_id为None时移除全部）"""
+    get_model_cache().discard(model_id)
+
+
+def _warm_up():
+    with app.app_context():
+        model = Model.query.order_by(Model.training_time.desc()).first()
+        if model is None or not os.path.exists(model.model_path):
+            return
+        try:
+            load_model(model)
+        except Exception:
+            logger.exception("预加载模型 %s 失败", model.id)
+
+
+def warm_up_model_cache():
+    """在后台线程中预加载最新训练的模型，第一次评估时不需要等待加载"""
+    # 训练进程导入app时也会执行到这里，只在Web进程中预加载
+    if not app.config['MODEL_CACHE_WARM_UP'] or multiprocessing.parent_process() is not None:
+        return
+    threading.Thread(target=_warm_up, name='model-cache-warm-up', daemon=True).start()
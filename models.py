@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime
+from sqlalchemy import inspect, text
 
 class DataFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,6 +11,19 @@ class DataFile(db.Model):
     status = db.Column(db.String(50), default='uploaded')  # uploaded, annotated, processed
     annotations = db.relationship('Annotation', backref='data_file', lazy=True)
 
+class Frame(db.Model):
+    """视频帧清单，由帧提取任务写入，标注/训练/评估按(data_file_id, frame_index)索引查询"""
+    __table_args__ = (db.Index('ix_frame_file_frame', 'data_file_id', 'frame_index', unique=True),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    data_file_id = db.Column(db.Integer, db.ForeignKey('data_file.id'), nullable=False)
+    frame_index = db.Column(db.Integer, nullable=False)  # 帧在打包文件中的编号（即Annotation.timestamp）
+    source_frame = db.Column(db.Integer, nullable=True)  # 在原视频中的帧编号
+    timestamp = db.Column(db.Float, nullable=True)  # 在原视频中的时间（秒）
+    path = db.Column(db.String(255), nullable=False)  # 帧所在的打包文件
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+
 class Annotation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     data_file_id = db.Column(db.Integer, db.ForeignKey('data_file.id'), nullable=False)
@@ -28,6 +42,26 @@ class Model(db.Model):
     accuracy = db.Column(db.Float, nullable=True)
     precision = db.Column(db.Float, nullable=True)
     recall = db.Column(db.Float, nullable=True)
+    params = db.Column(db.Text, nullable=True)  # 训练参数（分类器、特征提取器等），JSON
+    cv_results = db.Column(db.Text, nullable=True)  # 参数搜索的交叉验证结果（每组参数每折的指标），JSON
+
+class TrainingJob(db.Model):
+    """训练任务记录，由后台训练进程更新，训练页面轮询该记录显示进度"""
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False, default='full')  # full or incremental
+    state = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    status = db.Column(db.String(255), nullable=True)  # 当前步骤的说明
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    pid = db.Column(db.Integer, nullable=True)  # 训练进程的进程号
+    model_id = db.Column(db.Integer, db.ForeignKey('model.id'), nullable=True)  # 训练得到的模型
+    accuracy = db.Column(db.Float, nullable=True)
+    timings = db.Column(db.Text, nullable=True)  # 各步骤耗时（秒），JSON
+    peak_rss_mb = db.Column(db.Float, nullable=True)  # 训练进程的内存占用峰值（MB）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
 
 class Evaluation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -37,6 +71,44 @@ class Evaluation(db.Model):
     correct_predictions = db.Column(db.Integer, nullable=False)
     total_predictions = db.Column(db.Integer, nullable=False)
     accuracy = db.Column(db.Float, nullable=False)
+    frame_count = db.Column(db.Integer, nullable=True)  # 评估的帧数（包括没有标注的帧）
+    metrics = db.Column(db.Text, nullable=True)  # 各行为的出现次数、精确率、召回率和混淆矩阵，JSON
+    # 评估在后台执行（见eval_jobs），早期的评估没有状态，都已完成
+    state = db.Column(db.String(20), nullable=True)  # queued, running, succeeded, failed
+    progress = db.Column(db.Integer, nullable=True)  # 0-100
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    source_version = db.Column(db.String(255), nullable=True)  # 评估时模型文件、帧和标注的版本，都未变化时复用评估结果
+
+class FramePrediction(db.Model):
+    """评估的每帧预测结果，评估时按批写入，结果页面按(evaluation_id, frame_index)分页查询"""
+    __table_args__ = (db.Index('ix_frame_prediction_evaluation_frame', 'evaluation_id', 'frame_index'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    evaluation_id = db.Column(db.Integer, db.ForeignKey('evaluation.id'), nullable=False)
+    frame_index = db.Column(db.Integer, nullable=False)  # 帧编号，图片文件为0
+    predicted = db.Column(db.String(100), nullable=False)  # 预测的行为
+    confidence = db.Column(db.Float, nullable=True)  # 预测的置信度（见linear_inference）
+    true_behavior = db.Column(db.String(100), nullable=True)  # 评估时该帧标注的行为
+    coordinates = db.Column(db.String(255), nullable=True)  # 评估时该帧标注的目标坐标
+
+class VideoAnalysis(db.Model):
+    """直接从视频文件分析行为（见analysis_jobs），不提取视频帧，只保存行为时间线"""
+    id = db.Column(db.Integer, primary_key=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('model.id'), nullable=False)
+    data_file_id = db.Column(db.Integer, db.ForeignKey('data_file.id'), nullable=False)
+    sample_interval = db.Column(db.Float, nullable=False)  # 采样间隔（秒）
+    state = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    error = db.Column(db.Text, nullable=True)
+    frame_count = db.Column(db.Integer, nullable=True)  # 预测的采样帧数
+    duration = db.Column(db.Float, nullable=True)  # 视频时长（秒）
+    timeline = db.Column(db.Text, nullable=True)  # 行为时间线，JSON（见stream_inference.TimelineBuilder）
+    fps = db.Column(db.Float, nullable=True)  # 分析速度（采样帧/秒）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
 
 class TeachingBehavior(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,3 +117,20 @@ class TeachingBehavior(db.Model):
     description = db.Column(db.Text, nullable=True)  # 行为描述
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+def upgrade_schema():
+    """
+    为已有的表补充新增的列（db.create_all只创建缺少的表，不会修改已有的表）
+    新增的列都允许为空，已有的行取NULL
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    db.session.commit()
@@ -0,0 +1,328 @@
+"""实时识别
+
+从摄像头、网络视频流或已上传的视频文件持续读取画面并识别当前的教学行为。
+视频文件按原始帧率回放，可以代替摄像头测试::
+
+    采集线程 --最新帧（只保留一帧）--> 识别线程 --> 当前行为和统计
+
+采集线程总是用最新的画面覆盖上一帧，识别线程来不及处理的帧直接丢弃；
+识别线程取到的帧如果已经超过延迟预算（从采集到开始识别的时间），也丢弃并等待下一帧，
+因此识别结果总是对应最近的画面，延迟不会随时间累积。回放视频文件时处理跟不上原始帧率，
+采集线程只grab跳过落后的帧，与摄像头丢帧的表现一致。
+
+会话在Web进程中按编号管理（start_session/get_session/stop_session）。该模块不依赖Flask。
+"""
+import os
+import time
+import itertools
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+from linear_inference import predict_labels
+from video_frames import get_video_info
+
+# 默认延迟预算（秒）
+DEFAULT_LATENCY_BUDGET = 0.2
+
+# 默认允许的网络视频流协议
+DEFAULT_STREAM_SCHEMES = ('rtsp', 'rtsps', 'rtmp', 'rtmps')
+
+# 计算帧率和延迟统计的时间窗口（秒）
+STATS_WINDOW = 5.0
+
+# 会话的状态
+#   running: 正在识别
+#   finished: 视频文件回放结束
+#   stopped: 已停止
+#   failed: 无法打开视频源或识别出错
+SESSION_STATES = ('running', 'finished', 'stopped', 'failed')
+
+
+def parse_source(source, stream_schemes=DEFAULT_STREAM_SCHEMES):
+    """
+    把页面输入的视频源转换为cv2.VideoCapture的参数
+    只接受摄像头编号和允许协议的流地址，不接受服务器上的文件路径和其他地址（已上传的视频按数据文件回放）
+    :param stream_schemes: 允许的流地址协议
+    :return: 纯数字时为摄像头编号（int），否则为流地址
+    :raises ValueError: 不是摄像头编号，也不是允许协议的流地址
+    """
+    source = str(source).strip()
+    if source.isascii() and source.isdigit():
+        return int(source)
+    schemes = {scheme.strip().lower() for scheme in stream_schemes if scheme.strip()}
+    parsed = urlparse(source)
+    if parsed.scheme.lower() not in schemes or not parsed.netloc:
+        raise ValueError(f'视频源只能是摄像头编号或以下协议的流地址: {", ".join(sorted(schemes))}')
+    return source
+
+
+class RealtimeRecognizer:
+    """
+    一个视频源的实时识别会话
+    :param source: 摄像头编号、网络流地址或已上传的视频文件路径（见parse_source）
+    :param bundle: 模型文件内容（见model_cache.ModelCache.get）
+    :param extractor: 特征提取器，与训练模型时使用的一致
+    :param latency_budget: 延迟预算（秒），采集后超过该时间还没有开始识别的帧被丢弃
+    :param replay: 视频文件是否按原始帧率回放（否则尽快读取）
+    :param loop: 视频文件回放结束后是否从头开始
+    :param name: 页面显示的会话名称（例如模型名称）
+    """
+
+    def __init__(self, source, bundle, extractor, latency_budget=DEFAULT_LATENCY_BUDGET, replay=True, loop=False,
+                 name=None):
+        self.source = source
+        self.name = name
+        self.bundle = bundle
+        self.extractor = extractor
+        self.latency_budget = latency_budget
+        self.replay = replay
+        self.loop = loop
+        self.state = 'running'
+        self.error = None
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        # 最新的一帧：(帧图像, 源帧编号, 采集时间)，识别线程取走后为None
+        self._latest = None
+        self._capture_done = False
+        self._threads = []
+        # 当前的识别结果
+        self.behavior = None
+        self.confidence = None
+        self.frame_index = None
+        self.behavior_since = None
+        # 计数
+        self.captured = 0
+        self.processed = 0
+        self.dropped_overwritten = 0
+        self.dropped_stale = 0
+        self.dropped_replay = 0
+        self.over_budget = 0
+        # 时间窗口内的采集时间、识别完成时间和延迟
+        self._capture_times = deque()
+        self._process_times = deque()
+        self._latencies = deque()
+        self._stats_lock = threading.Lock()
+
+    def start(self):
+        for name, target in (('capture', self._capture), ('recognize', self._recognize)):
+            thread = threading.Thread(target=self._run_thread, args=(target,), name=f'realtime-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """停止采集和识别并等待线程退出"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self.state == 'running':
+            self.state = 'stopped'
+
+    def _run_thread(self, target):
+        try:
+            target()
+        except Exception as e:
+            if self.error is None:
+                self.error = str(e)
+            self.state = 'failed'
+            self._stop.set()
+            with self._cond:
+                self._cond.notify_all()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise ValueError(f'无法打开视频源: {self.source}')
+        return cap
+
+    def _publish(self, frame, frame_no):
+        now = time.monotonic()
+        with self._cond:
+            if self._latest is not None:
+                # 上一帧还没有被识别，只保留最新的画面
+                self.dropped_overwritten += 1
+            self._latest = (frame, frame_no, now)
+            self._cond.notify()
+        self.captured += 1
+        with self._stats_lock:
+            self._capture_times.append(now)
+            self._trim(self._capture_times, now)
+
+    def _capture(self):
+        cap = self._open()
+        try:
+            is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+            _, fps = get_video_info(cap)
+            pace = self.replay and is_file
+            start = time.monotonic()
+            frame_no = 0
+            while not self._stop.is_set():
+                if pace:
+                    # 落后于原始帧率时只grab跳过落后的帧
+                    behind = int((time.monotonic() - start) * fps) - frame_no
+                    for _ in range(max(behind, 0)):
+                        if not cap.grab():
+                            break
+                        frame_no += 1
+                        self.dropped_replay += 1
+                    delay = start + frame_no / fps - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    if is_file and self.loop:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        start = time.monotonic()
+                        frame_no = 0
+                        continue
+                    break
+                self._publish(frame, frame_no)
+                frame_no += 1
+        finally:
+            cap.release()
+            with self._cond:
+                self._capture_done = True
+                self._cond.notify_all()
+
+    def _recognize(self):
+        while True:
+            with self._cond:
+                while self._latest is None and not self._capture_done and not self._stop.is_set():
+                    self._cond.wait()
+                if self._latest is None or self._stop.is_set():
+                    break
+                frame, frame_no, captured_at = self._latest
+                self._latest = None
+            if time.monotonic() - captured_at > self.latency_budget:
+                self.dropped_stale += 1
+                continue
+            feature = np.asarray(self.extractor(frame)).reshape(1, -1)
+            labels, confidence = predict_labels(self.bundle, feature, return_confidence=True)
+            now = time.monotonic()
+            latency = now - captured_at
+            behavior = str(labels[0])
+            if behavior != self.behavior:
+                self.behavior_since = time.time() - latency
+            self.behavior = behavior
+            value = float(confidence[0])
+            self.confidence = None if value != value else value
+            self.frame_index = frame_no
+            self.processed += 1
+            if latency > self.latency_budget:
+                self.over_budget += 1
+            with self._stats_lock:
+                self._process_times.append(now)
+                self._latencies.append((now, latency))
+                self._trim(self._process_times, now)
+                while self._latencies and self._latencies[0][0] < now - STATS_WINDOW:
+                    self._latencies.popleft()
+        if self.state == 'running' and not self._stop.is_set():
+            self.state = 'finished'
+
+    @staticmethod
+    def _trim(times, now):
+        while times and times[0] < now - STATS_WINDOW:
+            times.popleft()
+
+    def stats(self):
+        """
+        当前的识别结果和统计，帧率和延迟按最近STATS_WINDOW秒计算
+        :return: {'state', 'error', 'name', 'source', 'behavior', 'confidence', 'frame_index', 'behavior_since', 'captured', 'processed',
+                  'dropped': {...}, 'capture_fps', 'process_fps', 'latency_ms': {'last', 'mean', 'p95', 'max'},
+                  'latency_budget_ms', 'over_budget', 'uptime'}
+        """
+        now = time.monotonic()
+        with self._stats_lock:
+            self._trim(self._capture_times, now)
+            self._trim(self._process_times, now)
+            while self._latencies and self._latencies[0][0] < now - STATS_WINDOW:
+                self._latencies.popleft()
+            latencies = np.array([latency for _, latency in self._latencies]) * 1000
+            capture_count = len(self._capture_times)
+            process_count = len(self._process_times)
+        window = min(STATS_WINDOW, max(time.time() - self.started_at, 1e-6))
+        return {
+            'state': self.state,
+            'error': self.error,
+            'name': self.name,
+            'source': str(self.source),
+            'behavior': self.behavior,
+            'confidence': self.confidence,
+            'frame_index': self.frame_index,
+            'behavior_since': self.behavior_since,
+            'captured': self.captured,
+            'processed': self.processed,
+            'dropped': {
+                'overwritten': self.dropped_overwritten,
+                'stale': self.dropped_stale,
+                'replay': self.dropped_replay
+            },
+            'capture_fps': round(capture_count / window, 2),
+            'process_fps': round(process_count / window, 2),
+            'latency_ms': {
+                'last': round(float(latencies[-1]), 2) if len(latencies) else None,
+                'mean': round(float(latencies.mean()), 2) if len(latencies) else None,
+                'p95': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+                'max': round(float(latencies.max()), 2) if len(latencies) else None
+            },
+            'latency_budget_ms': round(self.latency_budget * 1000, 2),
+            'over_budget': self.over_budget,
+            'uptime': round(time.time() - self.started_at, 2)
+        }
+
+
+# Web进程中的会话：session_id -> RealtimeRecognizer
+_sessions = {}
+_session_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def start_session(source, bundle, extractor, max_sessions=2, **options):
+    """
+    开始一个实时识别会话，已结束的会话在这里清理
+    :param max_sessions: 同时运行的会话数上限
+    :param options: 见RealtimeRecognizer
+    :return: (session_id, RealtimeRecognizer)
+    """
+    with _lock:
+        for session_id in [key for key, session in _sessions.items() if session.state != 'running']:
+            del _sessions[session_id]
+        if len(_sessions) >= max_sessions:
+            raise RuntimeError(f'最多同时运行 {max_sessions} 个实时识别会话')
+        session = RealtimeRecognizer(source, bundle, extractor, **options)
+        session_id = next(_session_ids)
+        _sessions[session_id] = session
+    session.start()
+    return session_id, session
+
+
+def get_session(session_id):
+    """会话不存在（已停止或被清理）时返回None"""
+    with _lock:
+        return _sessions.get(session_id)
+
+
+def stop_session(session_id):
+    """
+    停止并移除会话
+    :return: 停止前的最后统计，会话不存在时返回None
+    """
+    with _lock:
+        session = _sessions.pop(session_id, None)
+    if session is None:
+        return None
+    session.stop()
+    return session.stats()
+
+
+def list_sessions():
+    """[(session_id, RealtimeRecognizer), ...]，按开始顺序"""
+    with _lock:
+        return sorted(_sessions.items())
@@ -0,0 +1,130 @@
+"""数据访问层
+
+训练、评估和调试脚本通过这里读取已标注的数据：数据文件和标注用一次联表查询加载，
+再建立按 (数据文件ID, 帧编号) 查找标注的内存索引，避免按文件、按帧重复查询标注。
+评估的每帧预测结果（FramePrediction）也通过这里批量写入和分页读取。
+"""
+import hashlib
+
+from sqlalchemy import and_, insert
+
+from app import db
+from models import DataFile, Annotation, Frame, FramePrediction
+
+
+class AnnotationIndex:
+    """
+    已标注数据的内存索引
+    :param rows: 按数据文件、标注ID排序的 (DataFile, Annotation) 列表
+    """
+
+    def __init__(self, rows):
+        self._files = {}
+        self._annotations = {}
+        self._by_frame = {}
+        for data_file, annotation in rows:
+            if data_file.id not in self._files:
+                self._files[data_file.id] = data_file
+                self._annotations[data_file.id] = []
+            self._annotations[data_file.id].append(annotation)
+            # 视频标注的timestamp是帧编号；同一帧有多条标注时保留最早的一条
+            if annotation.timestamp is not None:
+                self._by_frame.setdefault((data_file.id, int(annotation.timestamp)), annotation)
+
+    def __len__(self):
+        """标注总数"""
+        return sum(len(annotations) for annotations in self._annotations.values())
+
+    @property
+    def files(self):
+        """有标注的数据文件"""
+        return list(self._files.values())
+
+    def items(self):
+        """[(DataFile, [Annotation, ...]), ...]"""
+        return [(self._files[file_id], annotations) for file_id, annotations in self._annotations.items()]
+
+    def for_file(self, file_id):
+        """数据文件的全部标注，没有时返回空列表"""
+        return self._annotations.get(file_id, [])
+
+    def get(self, file_id, frame_index):
+        """帧的标注，没有时返回None"""
+        return self._by_frame.get((file_id, frame_index))
+
+    def behaviors(self):
+        """标注中出现的行为类型"""
+        return {annotation.behavior for annotations in self._annotations.values() for annotation in annotations}
+
+
+def load_annotations(status='annotated', file_id=None, since=None, until=None):
+    """
+    用一次联表查询加载数据文件及其标注
+    :param status: 只加载该状态的数据文件，为None时不限制
+    :param file_id: 只加载该数据文件
+    :param since: 只加载标注时间晚于该时间的标注
+    :param until: 只加载标注时间不晚于该时间的标注
+    :return: AnnotationIndex
+    """
+    query = db.session.query(DataFile, Annotation).join(Annotation, Annotation.data_file_id == DataFile.id)
+    if status is not None:
+        query = query.filter(DataFile.status == status)
+    if file_id is not None:
+        query = query.filter(DataFile.id == file_id)
+    if since is not None:
+        query = query.filter(Annotation.annotation_time > since)
+    if until is not None:
+        query = query.filter(Annotation.annotation_time <= until)
+    return AnnotationIndex(query.order_by(DataFile.id, Annotation.id).all())
+
+
+def get_annotations_version(file_id):
+    """数据文件标注的版本（全部标注的摘要），标注增删改后改变"""
+    rows = db.session.query(Annotation.id, Annotation.timestamp, Annotation.behavior, Annotation.coordinates) \
+        .filter(Annotation.data_file_id == file_id).order_by(Annotation.id).all()
+    digest = hashlib.md5(repr([tuple(row) for row in rows]).encode('utf-8')).hexdigest()
+    return f'{len(rows)}-{digest}'
+
+
+def save_frame_predictions(evaluation_id, frames):
+    """
+    批量写入一批帧的预测结果（不提交事务）
+    :param frames: 每帧一项 {'frame_index', 'behavior', 'confidence', 'true_behavior', 'coordinates'}
+    """
+    if not frames:
+        return
+    db.session.execute(insert(FramePrediction), [{
+        'evaluation_id': evaluation_id,
+        'frame_index': frame['frame_index'],
+        'predicted': frame['behavior'],
+        'confidence': frame.get('confidence'),
+        'true_behavior': frame.get('true_behavior'),
+        'coordinates': frame.get('coordinates')
+    } for frame in frames])
+
+
+def page_frame_predictions(evaluation, page, per_page, behavior=None):
+    """
+    按帧编号顺序分页读取评估的每帧预测结果，原始帧尺寸从帧清单读取
+    :param behavior: 只返回预测为该行为的帧
+    :return: (本页的帧列表, 符合条件的帧总数)
+    """
+    query = FramePrediction.query.filter(FramePrediction.evaluation_id == evaluation.id)
+    if behavior is not None:
+        query = query.filter(FramePrediction.predicted == behavior)
+    total = query.count()
+    rows = query.outerjoin(Frame, and_(Frame.data_file_id == evaluation.data_file_id,
+                                       Frame.frame_index == FramePrediction.frame_index)) \
+        .with_entities(FramePrediction, Frame.width, Frame.height) \
+        .order_by(FramePrediction.frame_index, FramePrediction.id) \
+        .offset((page - 1) * per_page).limit(per_page).all()
+    frames = [{
+        'frame_index': prediction.frame_index,
+        'behavior': prediction.predicted,
+        'confidence': prediction.confidence,
+        'true_behavior': prediction.true_behavior,
+        'coordinates': prediction.coordinates or '',
+        'source_width': width,
+        'source_height': height
+    } for prediction, width, height in rows]
+    return frames, total
@@ -0,0 +1,284 @@
+"""直接从视频流式推理
+
+不提取和保存视频帧，一次读取视频完成采样、特征计算和预测，只输出行为时间线::
+
+    解码线程 --帧队列--> 特征线程（可多个） --特征队列--> 预测线程 --结果队列--> 调用方
+
+各阶段之间是有界队列，慢的阶段会让前面的阶段阻塞等待，内存中同时存在的原始帧不超过队列长度。
+特征线程并行时结果可能乱序，预测线程按采样顺序重新排列后再按批预测。
+调用方读取结果时出错或提前停止，所有阶段都会退出。该模块不依赖Flask。
+"""
+import queue
+import itertools
+import threading
+
+import numpy as np
+
+from linear_inference import predict_labels
+from video_frames import DEFAULT_SEEK_MIN_GAP, get_video_info, iter_video_frames, open_video_capture
+
+# 默认采样间隔（秒）、每批预测的帧数和帧队列长度
+DEFAULT_SAMPLE_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_QUEUE_SIZE = 32
+
+# 阶段结束的标记
+_END = object()
+
+# 等待队列时检查是否需要停止的间隔（秒）
+_POLL_INTERVAL = 0.2
+
+
+class PipelineStopped(Exception):
+    """流水线已停止（调用方停止或其他阶段出错）"""
+
+
+class StreamingPipeline:
+    """
+    解码、特征计算和预测三个阶段的流水线，迭代得到按采样顺序的预测结果
+    :param video_path: 视频文件路径
+    :param bundle: 模型文件内容（见model_cache.ModelCache.get）
+    :param extractor: 特征提取器，与训练模型时使用的一致
+    :param interval: 采样间隔（秒），0表示每一帧都预测
+    :param batch_size: 每批预测的帧数
+    :param feature_workers: 特征线程数
+    :param queue_size: 帧队列长度（特征队列为batch_size，结果队列为2批）
+    :param strategy: 跳过未采样的帧的方式，见video_frames.EXTRACT_STRATEGIES
+    """
+
+    def __init__(self, video_path, bundle, extractor, interval=DEFAULT_SAMPLE_INTERVAL, batch_size=DEFAULT_BATCH_SIZE,
+                 feature_workers=1, queue_size=DEFAULT_QUEUE_SIZE, strategy='auto'):
+        self.video_path = video_path
+        self.bundle = bundle
+        self.extractor = extractor
+        self.interval = interval
+        self.batch_size = max(int(batch_size), 1)
+        self.feature_workers = max(int(feature_workers), 1)
+        self.strategy = strategy
+        self._frames = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._features = queue.Queue(maxsize=self.batch_size)
+        self._results = queue.Queue(maxsize=2)
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+        # 视频信息，解码线程打开视频后设置
+        self.fps = None
+        self.total_frames = None
+        # 相邻采样帧的源帧间隔
+        self.step = None
+        self._opened = threading.Event()
+        # 各阶段处理的帧数
+        self.decoded = 0
+        self.predicted = 0
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        raise PipelineStopped()
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _decode(self):
+        try:
+            cap = open_video_capture(self.video_path)
+            self.total_frames, self.fps = get_video_info(cap)
+            self.step = max(int(round(self.fps * self.interval)), 1)
+        except Exception as e:
+            self._fail(e)
+            raise PipelineStopped()
+        finally:
+            self._opened.set()
+        try:
+            # 总帧数未知时一直读到视频结尾
+            frame_numbers = range(0, self.total_frames, self.step) if self.total_frames > 0 else \
+                itertools.count(0, self.step)
+            for seq, (frame_no, frame) in enumerate(iter_video_frames(cap, frame_numbers, self.strategy,
+                                                                      DEFAULT_SEEK_MIN_GAP)):
+                self._put(self._frames, (seq, frame_no, frame))
+                self.decoded += 1
+        finally:
+            cap.release()
+            # 每个特征线程一个结束标记
+            for _ in range(self.feature_workers):
+                self._put(self._frames, _END)
+
+    def _compute_features(self):
+        try:
+            while True:
+                item = self._get(self._frames)
+                if item is _END:
+                    break
+                seq, frame_no, frame = item
+                self._put(self._features, (seq, frame_no, self.extractor(frame)))
+        finally:
+            self._put(self._features, _END)
+
+    def _predict(self):
+        try:
+            pending = {}
+            next_seq = 0
+            batch_numbers, batch_features = [], []
+            running = self.feature_workers
+            while running:
+                item = self._get(self._features)
+                if item is _END:
+                    running -= 1
+                    continue
+                seq, frame_no, feature = item
+                pending[seq] = (frame_no, feature)
+                # 按采样顺序取出已经计算好的特征
+                while next_seq in pending:
+                    frame_no, feature = pending.pop(next_seq)
+                    batch_numbers.append(frame_no)
+                    batch_features.append(feature)
+                    next_seq += 1
+                    if len(batch_numbers) >= self.batch_size:
+                        self._predict_batch(batch_numbers, batch_features)
+                        batch_numbers, batch_features = [], []
+            if batch_numbers:
+                self._predict_batch(batch_numbers, batch_features)
+        finally:
+            self._put(self._results, _END)
+
+    def _predict_batch(self, frame_numbers, features):
+        labels, confidence = predict_labels(self.bundle, np.stack(features), return_confidence=True)
+        self.predicted += len(frame_numbers)
+        self._put(self._results, (np.asarray(frame_numbers), labels, confidence))
+
+    def start(self):
+        stages = [('decode', self._decode)]
+        stages += [(f'features-{i}', self._compute_features) for i in range(self.feature_workers)]
+        stages.append(('predict', self._predict))
+        for name, target in stages:
+            thread = threading.Thread(target=self._run_stage, args=(target,), name=f'stream-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        # 等待解码线程得到视频信息，调用方用来计算进度
+        self._opened.wait()
+        if self.fps is None:
+            self.close()
+            raise self._error
+
+    def close(self):
+        """停止所有阶段并等待线程退出"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __iter__(self):
+        """
+        :return: 生成器，每批一项 (源帧编号, 预测的行为, 置信度)，按采样顺序
+        """
+        if not self._threads:
+            self.start()
+        try:
+            while True:
+                try:
+                    item = self._get(self._results)
+                except PipelineStopped:
+                    break
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self.close()
+        # 各阶段都已退出，出错的阶段已经记录了异常
+        if self._error is not None:
+            raise self._error
+
+
+class TimelineBuilder:
+    """
+    把按采样顺序的预测结果合并为行为时间线，相邻且行为相同的采样帧合并为一段
+    :param fps: 视频帧率，用于把帧编号换算为秒
+    :param step: 相邻采样帧的源帧间隔（StreamingPipeline.step），最后一段持续到最后一个采样帧之后一个间隔
+    """
+
+    def __init__(self, fps, step):
+        self.fps = fps
+        self.interval = step / fps
+        self.segments = []
+        self.samples = 0
+
+    def add(self, frame_numbers, labels, confidence):
+        for frame_no, label, value in zip(frame_numbers, labels, confidence):
+            label = str(label)
+            value = float(value)
+            # 模型没有概率估计时置信度为NaN，不计入平均值
+            known = value == value
+            start = int(frame_no) / self.fps
+            last = self.segments[-1] if self.segments else None
+            if last is not None and last['behavior'] == label:
+                last['end_frame'] = int(frame_no)
+                last['end'] = round(start + self.interval, 3)
+                last['samples'] += 1
+                if known:
+                    last['_confidence'] += value
+                    last['_confidence_samples'] += 1
+            else:
+                if last is not None:
+                    # 上一段持续到本段开始
+                    last['end'] = round(start, 3)
+                self.segments.append({
+                    'behavior': label,
+                    'start': round(start, 3),
+                    'end': round(start + self.interval, 3),
+                    'start_frame': int(frame_no),
+                    'end_frame': int(frame_no),
+                    'samples': 1,
+                    '_confidence': value if known else 0.0,
+                    '_confidence_samples': int(known)
+                })
+            self.samples += 1
+
+    def timeline(self, duration=None):
+        """
+        :param duration: 视频时长（秒），最后一段不超过视频结尾
+        :return: [{'behavior', 'start', 'end'（秒）, 'start_frame', 'end_frame', 'samples',
+                   'confidence'（平均，模型没有概率估计时为None）}, ...]
+        """
+        segments = []
+        for segment in self.segments:
+            segment = dict(segment)
+            total = segment.pop('_confidence')
+            known = segment.pop('_confidence_samples')
+            segment['confidence'] = round(total / known, 4) if known else None
+            segments.append(segment)
+        if segments and duration:
+            segments[-1]['end'] = round(max(min(segments[-1]['end'], duration), segments[-1]['start']), 3)
+        return segments
+
+
+def timeline_summary(timeline):
+    """
+    各行为在时间线中的总时长
+    :return: {行为: 秒数}，按时长从长到短
+    """
+    totals = {}
+    for segment in timeline:
+        totals[segment['behavior']] = totals.get(segment['behavior'], 0) + segment['end'] - segment['start']
+    return {behavior: round(seconds, 3) for behavior, seconds in sorted(totals.items(), key=lambda x: -x[1])}
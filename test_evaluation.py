@@ -0,0 +1,74 @@
+"""评估指标与sklearn.metrics的一致性测试
+
+用法: python -m pytest test_evaluation.py（或 python -m unittest test_evaluation）
+"""
+import unittest
+from collections import Counter
+
+import numpy as np
+from sklearn.metrics import accuracy_score, confusion_matrix, precision_recall_fscore_support
+
+from evaluation import evaluation_metrics, metrics_to_json
+
+
+class EvaluationMetricsTest(unittest.TestCase):
+
+    def assert_matches_sklearn(self, predicted, true, labels):
+        metrics = evaluation_metrics(predicted, true, labels)
+        annotated = [i for i, value in enumerate(true) if value is not None]
+        y_true = [true[i] for i in annotated]
+        y_pred = [predicted[i] for i in annotated]
+        result_labels = metrics['labels']
+
+        np.testing.assert_array_equal(metrics['confusion'], confusion_matrix(y_true, y_pred, labels=result_labels))
+        precision, recall, _, support = precision_recall_fscore_support(
+            y_true, y_pred, labels=result_labels, average=None, zero_division=0)
+        np.testing.assert_allclose(metrics['precision'], precision)
+        np.testing.assert_allclose(metrics['recall'], recall)
+        np.testing.assert_array_equal(metrics['support'], support)
+        self.assertAlmostEqual(metrics['accuracy'], accuracy_score(y_true, y_pred))
+        self.assertEqual(metrics['total'], len(annotated))
+        # 预测次数包括没有标注的帧
+        counts = Counter(predicted)
+        self.assertEqual(metrics['counts'].tolist(), [counts[label] for label in result_labels])
+        return metrics
+
+    def test_zero_support_and_prediction_only_labels(self):
+        labels = ['lecturing', 'questioning', 'demonstration', 'assessment']
+        predicted = ['lecturing', 'lecturing', 'questioning', 'assessment', 'unknown', 'questioning', 'lecturing',
+                     'unknown', 'questioning']
+        true = ['lecturing', 'questioning', 'questioning', 'lecturing', 'lecturing', None, 'annotated_only', None,
+                'questioning']
+        metrics = self.assert_matches_sklearn(predicted, true, labels)
+        # 只出现在预测或标注中的行为按名称排序追加在已定义的行为之后
+        self.assertEqual(metrics['labels'], labels + ['annotated_only', 'unknown'])
+        # demonstration既没有预测也没有标注，assessment和unknown只出现在预测中
+        index = metrics['labels'].index
+        self.assertEqual(metrics['support'][index('demonstration')], 0)
+        self.assertEqual(metrics['support'][index('assessment')], 0)
+        self.assertEqual(metrics['support'][index('unknown')], 0)
+        self.assertEqual(metrics['predicted_totals'][index('annotated_only')], 0)
+
+    def test_random_labels(self):
+        rng = np.random.RandomState(0)
+        behaviors = np.array(['lecturing', 'questioning', 'group_discussion', 'individual_work', 'other'])
+        predicted = behaviors[rng.randint(0, 5, 500)].tolist()
+        true = [None if rng.rand() < 0.2 else value for value in behaviors[rng.randint(0, 4, 500)].tolist()]
+        self.assert_matches_sklearn(predicted, true, ['other', 'lecturing', 'assessment'])
+
+    def test_no_annotations(self):
+        metrics = evaluation_metrics(['lecturing', 'other'], [None, None], ['lecturing'])
+        self.assertEqual(metrics['labels'], ['lecturing', 'other'])
+        self.assertEqual(metrics['total'], 0)
+        self.assertEqual(metrics['accuracy'], 0.0)
+        self.assertEqual(metrics['counts'].tolist(), [1, 1])
+        self.assertFalse(metrics['confusion'].any())
+
+    def test_empty(self):
+        metrics = evaluation_metrics([], [], ['lecturing'])
+        self.assertEqual(metrics['counts'].tolist(), [0])
+        self.assertEqual(metrics_to_json(metrics)['confusion'], [[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
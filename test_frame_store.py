@@ -0,0 +1,176 @@
+"""帧打包文件格式测试
+
+用法: python -m pytest test_frame_store.py（或 python -m unittest test_frame_store）
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import frame_store
+from frame_store import (FramePack, FramePackWriter, FrameSetWriter, PreviewSpec, close_packs, get_frames_version,
+                         get_pack_path, list_frame_indices, merge_packs, open_frame_file, open_pack, read_frame,
+                         read_frame_bytes)
+
+
+def sample_frames(count):
+    """长度不同的帧数据，包括空帧"""
+    return [bytes([i % 256]) * (i * 37 % 500) for i in range(count)]
+
+
+class FramePackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames_dir = tempfile.mkdtemp()
+        self.path = get_pack_path(self.frames_dir)
+
+    def tearDown(self):
+        close_packs(self.frames_dir)
+        shutil.rmtree(self.frames_dir, ignore_errors=True)
+
+    def write_pack(self, frames, path=None):
+        with FramePackWriter(path or self.path) as writer:
+            for data in frames:
+                writer.append(data)
+
+    def test_round_trip(self):
+        frames = sample_frames(50)
+        self.write_pack(frames)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+        pack = FramePack(self.path)
+        self.assertEqual(len(pack), len(frames))
+        self.assertEqual([bytes(pack.get_bytes(i)) for i in range(len(pack))], frames)
+        with self.assertRaises(IndexError):
+            pack.get_bytes(len(frames))
+        pack.close()
+
+        self.assertEqual(list_frame_indices(self.frames_dir), list(range(len(frames))))
+        self.assertEqual(bytes(read_frame_bytes(self.frames_dir, 7)), frames[7])
+        self.assertIsNone(read_frame_bytes(self.frames_dir, len(frames)))
+
+    def test_empty_pack(self):
+        self.write_pack([])
+        self.assertEqual(len(FramePack(self.path)), 0)
+        self.assertEqual(list_frame_indices(self.frames_dir), [])
+
+    def test_image_round_trip(self):
+        image = np.random.RandomState(0).randint(0, 256, (24, 32, 3), dtype=np.uint8)
+        with FramePackWriter(self.path) as writer:
+            self.assertEqual(writer.append_image(image, '.png'), 0)
+        np.testing.assert_array_equal(read_frame(self.frames_dir, 0), image)
+
+    def truncate(self, path, size):
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:size])
+
+    def test_truncated_pack(self):
+        self.write_pack(sample_frames(5))
+        size = os.path.getsize(self.path)
+        truncated_path = os.path.join(self.frames_dir, 'truncated.pack')
+        # 写入中断或被截断的文件在任何位置都不能打开，而不是读出错位的帧
+        for truncated_size in range(size):
+            shutil.copy(self.path, truncated_path)
+            self.truncate(truncated_path, truncated_size)
+            with self.assertRaises(ValueError, msg=f'size={truncated_size}'):
+                FramePack(truncated_path)
+
+    def test_footer_with_missing_index(self):
+        self.write_pack(sample_frames(5))
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # 头部和尾部完整，但数据和索引丢失
+        with open(self.path, 'wb') as f:
+            f.write(data[:frame_store._HEADER.size] + data[-frame_store._FOOTER.size:])
+        with self.assertRaises(ValueError):
+            FramePack(self.path)
+
+    def test_not_a_pack(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe0' + b'\0' * 60)
+        with self.assertRaises(ValueError):
+            FramePack(self.path)
+
+    def test_failed_write_keeps_previous_pack(self):
+        self.write_pack([b'old'])
+        with self.assertRaises(RuntimeError):
+            with FramePackWriter(self.path) as writer:
+                writer.append(b'new')
+                raise RuntimeError('extraction failed')
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+        self.assertEqual(bytes(read_frame_bytes(self.frames_dir, 0)), b'old')
+
+    def test_rewrite_changes_version_and_mapping(self):
+        self.write_pack([b'a' * 10])
+        version = get_frames_version(self.frames_dir)
+        old_pack = open_pack(self.path)
+        self.write_pack([b'b' * 20, b'c'])
+        # 替换前释放了旧文件的映射，之后读到的是新文件
+        self.assertTrue(old_pack._mmap.closed)
+        self.assertNotEqual(get_frames_version(self.frames_dir), version)
+        self.assertEqual(bytes(read_frame_bytes(self.frames_dir, 1)), b'c')
+
+    def test_merge_packs(self):
+        frames = sample_frames(12)
+        parts = [f'{self.path}.part{i:02d}' for i in range(3)]
+        for i, part in enumerate(parts):
+            self.write_pack(frames[i * 4:(i + 1) * 4], part)
+        self.assertEqual(merge_packs(parts + [f'{self.path}.part99'], self.path), len(frames))
+        self.assertFalse(any(os.path.exists(part) for part in parts))
+        pack = open_pack(self.path)
+        self.assertEqual([bytes(pack.get_bytes(i)) for i in range(len(pack))], frames)
+
+    def test_frame_set_variants_aligned(self):
+        rng = np.random.RandomState(1)
+        images = [rng.randint(0, 256, (120, 160, 3), dtype=np.uint8) for _ in range(3)]
+        previews = [PreviewSpec('thumb', 40, '.jpg', 80)]
+        with FrameSetWriter(self.frames_dir, previews) as writer:
+            for image in images:
+                writer.append_image(image)
+        self.assertEqual(len(open_pack(get_pack_path(self.frames_dir, 'thumb'))), len(images))
+        self.assertEqual(max(read_frame(self.frames_dir, 0).shape[:2]), 160)
+
+        # 重新提取时不再生成预览图，遗留的预览图被删除，读取预览图时回退到原始帧
+        with FrameSetWriter(self.frames_dir) as writer:
+            writer.append_image(images[0])
+        self.assertFalse(os.path.exists(get_pack_path(self.frames_dir, 'thumb')))
+        self.assertEqual(bytes(read_frame_bytes(self.frames_dir, 0, 'thumb')),
+                         bytes(read_frame_bytes(self.frames_dir, 0)))
+
+    def test_open_frame_file(self):
+        frames = sample_frames(6)
+        self.write_pack(frames)
+        file, _ = open_frame_file(self.frames_dir, 5)
+        with file:
+            self.assertEqual(file.length, len(frames[5]))
+            # 按块读取时也不会读到下一帧或索引
+            chunks = iter(lambda: file.read(64), b'')
+            self.assertEqual(b''.join(chunks), frames[5])
+        self.assertIsNone(open_frame_file(self.frames_dir, 6))
+
+    def test_open_frame_file_truncated_pack(self):
+        images = [np.full((120, 160, 3), i * 40, dtype=np.uint8) for i in range(3)]
+        with FrameSetWriter(self.frames_dir, [PreviewSpec('thumb', 40, '.jpg', 80)]) as writer:
+            for image in images:
+                writer.append_image(image)
+        thumb_path = get_pack_path(self.frames_dir, 'thumb')
+        self.truncate(thumb_path, os.path.getsize(thumb_path) - 1)
+
+        # 损坏的预览图回退到原始帧
+        file, _ = open_frame_file(self.frames_dir, 1, 'thumb')
+        with file:
+            self.assertEqual(file.read(), bytes(read_frame_bytes(self.frames_dir, 1)))
+
+        # 原始帧也损坏时按帧不存在处理
+        close_packs(self.frames_dir)
+        self.truncate(self.path, os.path.getsize(self.path) - 1)
+        self.assertIsNone(open_frame_file(self.frames_dir, 1))
+        self.assertIsNone(open_frame_file(self.frames_dir, 1, 'thumb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
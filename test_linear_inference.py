@@ -0,0 +1,105 @@
+"""导出的线性模型与sklearn模型预测结果的一致性测试
+
+用法: python -m pytest test_linear_inference.py（或 python -m unittest test_linear_inference）
+"""
+import unittest
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+from linear_inference import benchmark_inference, export_linear, predict_labels
+from stream_inference import TimelineBuilder
+from training import build_classifier
+
+
+def make_samples(n_classes, rows=240, dim=8, seed=0, dtype=np.float32):
+    """每个类别一个中心的带噪声样本，相邻类别有重叠，保证有靠近决策边界的样本"""
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(40, 200, size=(n_classes, dim))
+    y = np.arange(rows) % n_classes
+    X = centers[y] + rng.normal(scale=50, size=(rows, dim))
+    X = np.clip(X, 0, 255).astype(dtype)
+    behaviors = np.array(['lecturing', 'questioning', 'group_discussion', 'demonstration', 'other'])[:n_classes]
+    return X, behaviors[y]
+
+
+def train_bundle(name, n_classes, dtype=np.float32):
+    X, labels = make_samples(n_classes, dtype=dtype)
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(labels)
+    model = build_classifier(name)
+    model.fit(X, y)
+    bundle = {'model': model, 'label_encoder': label_encoder}
+    return bundle, export_linear(model, label_encoder), X
+
+
+class PredictLabelsParityTest(unittest.TestCase):
+    """predict_labels使用导出的线性模型时，结果与sklearn模型的predict完全一致"""
+
+    def assert_parity(self, name, n_classes, dtype=np.float32):
+        bundle, linear, X = train_bundle(name, n_classes, dtype)
+        self.assertIsNotNone(linear)
+        expected = bundle['label_encoder'].inverse_transform(bundle['model'].predict(X))
+        np.testing.assert_array_equal(predict_labels(dict(bundle, linear=linear), X), expected)
+        # 没有导出的线性模型时使用sklearn模型
+        np.testing.assert_array_equal(predict_labels(bundle, X), expected)
+
+        labels, confidence = predict_labels(dict(bundle, linear=linear), X, return_confidence=True)
+        np.testing.assert_array_equal(labels, expected)
+        self.assertTrue(np.all((confidence >= 0) & (confidence <= 1)))
+
+    def test_svc_ovo_multiclass(self):
+        self.assert_parity('svc', 4)
+
+    def test_svc_ovo_three_classes_uint8(self):
+        self.assert_parity('svc', 3, dtype=np.uint8)
+
+    def test_svc_binary(self):
+        self.assert_parity('svc', 2)
+
+    def test_scaled_sgd_multiclass(self):
+        self.assert_parity('sgd', 5)
+
+    def test_scaled_sgd_binary_uint8(self):
+        self.assert_parity('sgd', 2, dtype=np.uint8)
+
+    def test_benchmark_agreement(self):
+        bundle, linear, X = train_bundle('svc', 3)
+        results = benchmark_inference(bundle, linear, X, repeats=1)
+        self.assertEqual([row['agreement'] for row in results], [1.0, 1.0, 1.0])
+
+    def test_sklearn_fallback_confidence(self):
+        # SVC没有概率估计，只使用sklearn模型时置信度为NaN
+        bundle, _, X = train_bundle('svc', 3)
+        labels, confidence = predict_labels(bundle, X[:5], return_confidence=True)
+        self.assertEqual(len(labels), 5)
+        self.assertTrue(np.all(np.isnan(confidence)))
+
+    def test_timeline_without_confidence(self):
+        # 没有概率估计时时间线中的置信度为None（未知），而不是0
+        bundle, linear, X = train_bundle('svc', 3)
+        frame_numbers = np.arange(len(X)) * 10
+        builder = TimelineBuilder(fps=10, step=10)
+        builder.add(frame_numbers, *predict_labels(bundle, X, return_confidence=True))
+        timeline = builder.timeline()
+        self.assertEqual(sum(segment['samples'] for segment in timeline), len(X))
+        self.assertTrue(all(segment['confidence'] is None for segment in timeline))
+
+        # 使用导出的线性模型时有置信度
+        builder = TimelineBuilder(fps=10, step=10)
+        builder.add(frame_numbers, *predict_labels(dict(bundle, linear=linear), X, return_confidence=True))
+        self.assertTrue(all(0 <= segment['confidence'] <= 1 for segment in builder.timeline()))
+
+    def test_timeline_partial_confidence(self):
+        # 只对有置信度的采样帧求平均
+        builder = TimelineBuilder(fps=1, step=1)
+        builder.add([0, 1, 2, 3], ['lecturing', 'lecturing', 'lecturing', 'questioning'],
+                    [0.5, float('nan'), 0.7, float('nan')])
+        timeline = builder.timeline()
+        self.assertEqual([segment['samples'] for segment in timeline], [3, 1])
+        self.assertAlmostEqual(timeline[0]['confidence'], 0.6)
+        self.assertIsNone(timeline[1]['confidence'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
-from app import app
-from routes import train_model
+from app import app, db
+from models import TrainingJob
+from train_jobs import get_job_status, run_training_job
 
-# 直接调用train_model函数进行测试
+# 在当前进程中直接执行训练任务进行测试（不启动后台训练进程）
 if __name__ == '__main__':
     with app.app_context():
-        train_model()
\ No newline at end of file
+        job = TrainingJob(mode='full', state='queued', progress=0)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+    run_training_job(job_id)
+    with app.app_context():
+        print(get_job_status(db.session.get(TrainingJob, job_id)))
\ No newline at end of file
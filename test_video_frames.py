@@ -0,0 +1,179 @@
+"""视频帧提取计划、解码策略和场景变化检测测试
+
+用法: python -m pytest test_video_frames.py（或 python -m unittest test_video_frames）
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from video_frames import (EXTRACT_STRATEGIES, SceneChangeDetector, iter_video_frames, open_video_capture,
+                          plan_frame_numbers)
+
+# 测试视频：每帧为纯色，亮度为 帧编号 * BRIGHTNESS_STEP，解码后按亮度还原帧编号
+BRIGHTNESS_STEP = 6
+
+
+def write_test_video(path, frames=40, fps=10, size=(32, 24)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for i in range(frames):
+        writer.write(np.full((size[1], size[0], 3), i * BRIGHTNESS_STEP, dtype=np.uint8))
+    writer.release()
+
+
+def frame_number(frame):
+    return int(round(float(frame.mean()) / BRIGHTNESS_STEP))
+
+
+class PlanFrameNumbersTest(unittest.TestCase):
+
+    def assert_valid_plan(self, plan, total_frames):
+        self.assertEqual(plan, sorted(set(plan)))
+        if total_frames > 0:
+            self.assertTrue(all(0 <= frame_no < total_frames for frame_no in plan))
+
+    def test_whole_seconds(self):
+        self.assertEqual(plan_frame_numbers(3000, 25, 1, max_frames=0), list(range(0, 3000, 25)))
+        self.assertEqual(plan_frame_numbers(3000, 25, 2, max_frames=0), list(range(0, 3000, 50)))
+
+    def test_last_frame_not_past_end(self):
+        # 10秒、10fps：第10秒的帧编号100已超出视频
+        plan = plan_frame_numbers(100, 10, 1, max_frames=0)
+        self.assertEqual(plan, list(range(0, 100, 10)))
+        # 总帧数正好多出一帧时包括该帧
+        self.assertEqual(plan_frame_numbers(101, 10, 1, max_frames=0)[-1], 100)
+
+    def test_fractional_fps(self):
+        plan = plan_frame_numbers(300, 29.97, 1, max_frames=0)
+        self.assertEqual(plan, list(range(0, 300, 29)))
+        self.assert_valid_plan(plan, 300)
+
+    def test_interval_shorter_than_a_frame(self):
+        # 间隔小于一帧或为0时逐帧提取
+        self.assertEqual(plan_frame_numbers(50, 25, 0.01, max_frames=0), list(range(50)))
+        self.assertEqual(plan_frame_numbers(50, 25, 0, max_frames=0), list(range(50)))
+
+    def test_interval_longer_than_video(self):
+        self.assertEqual(plan_frame_numbers(50, 25, 10, max_frames=0), [0])
+        self.assertEqual(plan_frame_numbers(1, 25, 1, max_frames=0), [0])
+
+    def test_max_frames(self):
+        self.assertEqual(plan_frame_numbers(3000, 25, 1, max_frames=10), list(range(0, 250, 25)))
+        self.assertEqual(len(plan_frame_numbers(3000, 25, 1, max_frames=500)), 120)
+
+    def test_unknown_total_frames(self):
+        # 总帧数未知时按max_frames规划，读到视频结尾即停止
+        self.assertEqual(plan_frame_numbers(-1, 30, 0.5, max_frames=4), [0, 15, 30, 45])
+
+    def test_random_edges(self):
+        rng = np.random.RandomState(0)
+        for _ in range(200):
+            total_frames = int(rng.randint(1, 5000))
+            fps = float(rng.choice([1, 10, 23.976, 25, 29.97, 30, 59.94, 60]))
+            interval = float(rng.choice([0.04, 0.5, 1, 1.5, 2, 7, 60]))
+            plan = plan_frame_numbers(total_frames, fps, interval, max_frames=0)
+            self.assert_valid_plan(plan, total_frames)
+            step = max(int(fps * interval), 1)
+            self.assertEqual(plan, list(range(0, step * len(plan), step)))
+            # 下一个采样点超出视频，或者已达到按时长计算的采样数
+            self.assertTrue(plan[-1] + step >= total_frames or len(plan) == int(total_frames / fps / interval) + 1)
+
+
+class IterVideoFramesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.tmp_dir, 'video.avi')
+        write_test_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir, ignore_errors=True)
+
+    def decode(self, targets, strategy, seek_min_gap=3):
+        cap = open_video_capture(self.video_path)
+        try:
+            return [(target, frame_number(frame))
+                    for target, frame in iter_video_frames(cap, targets, strategy, seek_min_gap)]
+        finally:
+            cap.release()
+
+    def test_strategies_decode_the_same_frames(self):
+        targets = [0, 1, 4, 5, 17, 30, 39]
+        expected = [(target, target) for target in targets]
+        for strategy in EXTRACT_STRATEGIES:
+            self.assertEqual(self.decode(targets, strategy), expected, strategy)
+
+    def test_stops_at_end_of_video(self):
+        for strategy in EXTRACT_STRATEGIES:
+            self.assertEqual(self.decode([10, 39, 40, 45], strategy), [(10, 10), (39, 39)], strategy)
+
+    def test_plan_for_video(self):
+        cap = open_video_capture(self.video_path)
+        try:
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+        finally:
+            cap.release()
+        plan = plan_frame_numbers(total_frames, fps, 1.5)
+        self.assertEqual([frame_no for frame_no, _ in self.decode(plan, 'auto')], [0, 15, 30])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.decode([0], 'fast')
+
+
+class SceneChangeDetectorTest(unittest.TestCase):
+    """fps为1时帧编号即秒数"""
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.base = rng.randint(0, 256, (48, 64, 3), dtype=np.uint8)
+        # 只有右半部分变化，差异明显小于整幅画面变化
+        self.partial = self.base.copy()
+        self.partial[:, 32:] = 255 - self.partial[:, 32:]
+
+    def difference(self, a, b):
+        detector = SceneChangeDetector(1)
+        return detector.difference(detector.signature(a), detector.signature(b))
+
+    def test_difference_range(self):
+        black = np.zeros((48, 64, 3), dtype=np.uint8)
+        self.assertAlmostEqual(self.difference(self.base, self.base), 0.0, places=6)
+        self.assertAlmostEqual(self.difference(black, black + 255), 1.0, places=6)
+        self.assertTrue(0 < self.difference(self.base, self.partial) < 1)
+
+    def test_threshold(self):
+        change = self.difference(self.base, self.partial)
+        for threshold, kept in ((change - 0.01, True), (change + 0.01, False)):
+            detector = SceneChangeDetector(1, threshold=threshold, min_gap=1, max_gap=30)
+            self.assertTrue(detector.keep(0, self.base))
+            self.assertEqual(detector.keep(5, self.partial), kept, threshold)
+
+    def test_compares_with_last_kept_frame(self):
+        # 缓慢变化的画面：每一步都低于阈值，但与上一个保留的帧累计的差异超过阈值后保留
+        detector = SceneChangeDetector(1, threshold=0.1, min_gap=1, max_gap=1000)
+        kept = [frame_no for frame_no in range(0, 40)
+                if detector.keep(frame_no, np.full((48, 64, 3), frame_no * 3, dtype=np.uint8))]
+        self.assertEqual(kept[0], 0)
+        self.assertGreater(len(kept), 1)
+        self.assertLess(len(kept), 40)
+
+    def test_min_and_max_gap(self):
+        detector = SceneChangeDetector(1, threshold=0.1, min_gap=2, max_gap=10)
+        self.assertTrue(detector.keep(0, self.base))
+        # 间隔小于min_gap时即使画面完全变化也不保留
+        self.assertFalse(detector.keep(1, 255 - self.base))
+        # 画面不变时不保留，直到间隔达到max_gap
+        self.assertFalse(detector.keep(9, self.base))
+        self.assertTrue(detector.keep(10, self.base))
+        self.assertFalse(detector.keep(11, 255 - self.base))
+        self.assertTrue(detector.keep(12, 255 - self.base))
+
+
+if __name__ == '__main__':
+    unittest.main()
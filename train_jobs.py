@@ -0,0 +1,593 @@
+"""后台训练任务
+
+训练在独立的进程中执行（入口见train_worker），Web请求只创建 ``TrainingJob`` 记录并启动进程后立即返回。
+训练进程把状态（queued → running → succeeded / failed / cancelled）、进度和各步骤耗时写入该记录，
+训练页面通过 ``/train/status`` 轮询。
+
+- 同一时间只运行一个训练任务
+- 取消：先设置 ``cancel_requested``，训练进程在下一次更新进度时退出；
+  超过 ``TRAIN_CANCEL_GRACE`` 秒仍未退出（例如正在拟合分类器）时结束训练进程
+- 重启：服务启动时把训练进程已经不存在的未完成任务标记为失败；
+  训练进程不随Web进程退出，重启期间仍在运行的任务会继续更新自己的记录
+"""
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不统计内存占用峰值
+    resource = None
+
+import joblib
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+from app import app, db
+from app_logging import get_job_logger, get_worker_log_queue
+from feature_store import FeatureMatrix, get_frame_features, get_image_features
+from features import get_extractor
+from model_cache import warm_up_model_cache
+from models import Model, TeachingBehavior, TrainingJob
+from repository import load_annotations
+from training import (DEFAULT_SEARCH_GRID, cross_validate_grid, fit_all, fit_full, fit_incremental, save_bundle,
+                      supports_partial_fit)
+from train_worker import run_training_process
+
+logger = logging.getLogger(__name__)
+
+TRAINING_MODES = ('full', 'incremental', 'search')
+
+# 未结束的任务状态
+ACTIVE_STATES = ('queued', 'running')
+
+# 训练进程更新进度的最小间隔（秒），开始/结束各步骤时总是立即更新
+PROGRESS_INTERVAL = 0.5
+
+# 训练时每批从特征缓存读取的帧数
+FEATURE_BATCH_SIZE = 1024
+
+_lock = threading.Lock()
+_log_queue = None
+
+
+class TrainingCancelled(Exception):
+    """训练任务已被取消"""
+
+
+class TrainingError(Exception):
+    """训练无法进行，例如没有可用的已标注数据"""
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 进程存在但没有权限发送信号
+        return True
+    return True
+
+
+def get_peak_rss_mb():
+    """当前进程的内存占用峰值（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS的单位是字节，Linux是KB
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+
+
+def get_active_job():
+    """正在排队或运行的训练任务，没有时返回None"""
+    return TrainingJob.query.filter(TrainingJob.state.in_(ACTIVE_STATES)) \
+        .order_by(TrainingJob.id.desc()).first()
+
+
+def get_job_status(job):
+    """
+    训练任务的状态，供/train/status返回
+    :return: 字典，没有训练任务时返回未开始的状态
+    """
+    if job is None:
+        return {'job_id': None, 'state': None, 'progress': 0, 'status': '未开始训练', 'running': False}
+    end = job.finished_at or datetime.utcnow()
+    return {
+        'job_id': job.id,
+        'mode': job.mode,
+        'state': job.state,
+        'progress': job.progress,
+        'status': job.status,
+        'error': job.error,
+        'running': job.state in ACTIVE_STATES,
+        'cancel_requested': job.cancel_requested,
+        'accuracy': job.accuracy,
+        'model_id': job.model_id,
+        'timings': json.loads(job.timings) if job.timings else {},
+        'peak_rss_mb': job.peak_rss_mb,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'elapsed': round((end - job.started_at).total_seconds(), 1) if job.started_at else 0
+    }
+
+
+def enqueue_training(mode):
+    """
+    创建训练任务并启动训练进程
+    :param mode: full或incremental
+    :return: (TrainingJob, None)，已有训练任务在进行时返回(None, 说明)
+    """
+    global _log_queue
+    if mode not in TRAINING_MODES:
+        raise ValueError(f'未知的训练方式: {mode}')
+    with _lock:
+        if get_active_job() is not None:
+            return None, '已有训练任务在进行中，请稍后再试'
+        job = TrainingJob(mode=mode, state='queued', progress=0, status='正在启动训练...')
+        db.session.add(job)
+        db.session.commit()
+
+        # 使用spawn启动子进程，避免在多线程的Web进程中fork
+        ctx = multiprocessing.get_context('spawn')
+        if _log_queue is None:
+            _log_queue = get_worker_log_queue(ctx)
+        process = ctx.Process(target=run_training_process, name=f'train-{job.id}',
+                              args=(job.id, _log_queue, app.config['LOG_LEVEL']))
+        process.start()
+        job.pid = process.pid
+        db.session.commit()
+        get_job_logger(__name__, train_job=job.id).info("已启动训练进程: pid=%s, 方式: %s", process.pid, mode)
+
+    threading.Thread(target=_watch_process, args=(job.id, process), daemon=True).start()
+    return job, None
+
+
+def _watch_process(job_id, process):
+    """训练进程退出后检查任务记录，进程异常退出时任务不会被标记为结束"""
+    process.join()
+    with app.app_context():
+        job = db.session.get(TrainingJob, job_id)
+        _finish_orphaned_job(job, f'训练进程异常退出（退出码 {process.exitcode}）')
+        succeeded = job is not None and job.state == 'succeeded'
+    if succeeded:
+        # 新训练的模型是最新的模型，预加载到缓存
+        warm_up_model_cache()
+
+
+def _finish_orphaned_job(job, error):
+    """把训练进程已经退出但仍未结束的任务标记为取消或失败"""
+    if job is None or job.state not in ACTIVE_STATES:
+        return
+    if job.cancel_requested:
+        job.state = 'cancelled'
+        job.status = '训练已取消'
+    else:
+        job.state = 'failed'
+        job.status = f'训练失败: {error}'
+        job.error = error
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    get_job_logger(__name__, train_job=job.id).warning("训练任务已结束: %s", job.status)
+
+
+def cancel_training(job_id):
+    """
+    请求取消训练任务
+    :return: 是否已请求取消（任务不存在或已经结束时返回False）
+    """
+    job = db.session.get(TrainingJob, job_id)
+    if job is None or job.state not in ACTIVE_STATES:
+        return False
+    job.cancel_requested = True
+    job.status = '正在取消训练...'
+    db.session.commit()
+    get_job_logger(__name__, train_job=job_id).info("已请求取消训练任务")
+    timer = threading.Timer(app.config['TRAIN_CANCEL_GRACE'], _terminate_job, args=(job_id,))
+    timer.daemon = True
+    timer.start()
+    return True
+
+
+def _terminate_job(job_id):
+    """取消后训练进程在宽限时间内没有退出时结束该进程"""
+    with app.app_context():
+        job = db.session.get(TrainingJob, job_id)
+        if job is None or job.state not in ACTIVE_STATES:
+            return
+        if _pid_alive(job.pid):
+            get_job_logger(__name__, train_job=job_id).warning("训练进程未响应取消，结束进程: pid=%s", job.pid)
+            try:
+                os.kill(job.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        _finish_orphaned_job(job, '训练进程已结束')
+
+
+def recover_training_jobs():
+    """服务启动时把训练进程已经不存在的未完成任务标记为失败"""
+    # 训练进程导入app时也会执行到这里，只在Web进程中检查
+    if multiprocessing.parent_process() is not None:
+        return
+    for job in TrainingJob.query.filter(TrainingJob.state.in_(ACTIVE_STATES)).all():
+        if not _pid_alive(job.pid):
+            _finish_orphaned_job(job, '服务重启，训练进程已不存在')
+
+
+class JobReporter:
+    """
+    在训练进程中更新任务记录的进度，同时检查是否已被取消
+    :raises TrainingCancelled: 任务已被取消
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.last_update = 0
+        self.timings = {}
+        self.step = None
+        self.step_start = None
+
+    def __call__(self, progress, status, force=True):
+        now = time.monotonic()
+        if not force and now - self.last_update < PROGRESS_INTERVAL:
+            return
+        self.last_update = now
+        self.job.progress = progress
+        self.job.status = status
+        self.job.peak_rss_mb = get_peak_rss_mb()
+        db.session.commit()
+        # 提交后重新读取记录，取消请求由Web进程写入
+        if self.job.cancel_requested:
+            raise TrainingCancelled()
+
+    def start_step(self, step, progress, status):
+        """开始新的步骤并记录上一个步骤的耗时"""
+        self.end_step()
+        self.step = step
+        self.step_start = time.monotonic()
+        self(progress, status)
+
+    def end_step(self):
+        if self.step is not None:
+            self.timings[self.step] = round(time.monotonic() - self.step_start, 3)
+            self.job.timings = json.dumps(self.timings)
+            self.step = None
+
+
+def run_training_job(job_id):
+    """在训练进程中执行训练任务并更新任务记录"""
+    log = get_job_logger(__name__, train_job=job_id)
+    with app.app_context():
+        job = db.session.get(TrainingJob, job_id)
+        if job is None or job.state != 'queued':
+            log.warning("训练任务不存在或已开始")
+            return
+        report = JobReporter(job)
+        try:
+            job.state = 'running'
+            job.pid = os.getpid()
+            job.started_at = datetime.utcnow()
+            report(0, '正在准备训练...')
+            train_model(job, report, log)
+            job.state = 'succeeded'
+        except TrainingCancelled:
+            db.session.rollback()
+            log.info("训练任务已取消")
+            job.state = 'cancelled'
+            job.status = '训练已取消'
+        except TrainingError as e:
+            db.session.rollback()
+            log.warning("%s", e)
+            job.state = 'failed'
+            job.progress = 0
+            job.status = str(e)
+            job.error = str(e)
+        except Exception as e:
+            # 训练失败，记录详细错误信息
+            db.session.rollback()
+            log.exception("训练失败")
+            job.state = 'failed'
+            job.progress = 0
+            job.status = f'训练失败: {str(e)}'
+            job.error = str(e)
+        finally:
+            report.end_step()
+            job.peak_rss_mb = get_peak_rss_mb()
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+
+def _collect_training_data(file_annotations, extractor, report, log, progress_range=(20, 80)):
+    """
+    提取标注帧的特征（优先读取特征缓存，未缓存的帧才解码图片），写入按标注数量预分配的特征矩阵
+    :param file_annotations: [(DataFile, [Annotation, ...]), ...]
+    :param progress_range: 该步骤对应的总进度范围
+    :return: FeatureMatrix，使用完后需要close
+    """
+    progress_start, progress_end = progress_range
+    total_annotations = sum(len(annotations) for _, annotations in file_annotations)
+    matrix = FeatureMatrix(total_annotations, extractor, app.config['TRAIN_MEMORY_BUDGET_MB'] * 2 ** 20)
+    processed_annotations = 0
+
+    def report_progress(current):
+        report(progress_start + int((progress_end - progress_start) * current / total_annotations),
+               f'正在处理数据... ({current}/{total_annotations})', force=False)
+
+    try:
+        for file, annotations in file_annotations:
+            if file.file_type == 'image':
+                # 直接从图片文件提取特征
+                features = get_image_features(file.id, file.filepath, extractor)
+                if features is not None:
+                    for annotation in annotations:
+                        matrix.append(features, annotation.behavior)
+            elif file.file_type == 'video':
+                # 使用已经提取的帧图片，而不是重新从视频中提取
+                frame_annotations = []
+                for annotation in annotations:
+                    if annotation.timestamp is not None:
+                        frame_annotations.append(annotation)
+                    else:
+                        # 标注没有帧索引，跳过
+                        log.warning("标注没有帧索引: %s, 标注ID: %s", file.filename, annotation.id)
+
+                # 分批读取特征，每批只在内存中保留FEATURE_BATCH_SIZE行
+                for batch_start in range(0, len(frame_annotations), FEATURE_BATCH_SIZE):
+                    batch = frame_annotations[batch_start:batch_start + FEATURE_BATCH_SIZE]
+                    frame_indices = [int(annotation.timestamp) for annotation in batch]
+
+                    # 未缓存的帧在线程池中解码，按已计算的帧数更新进度
+                    def report_frames(done, total, processed=processed_annotations + batch_start, count=len(batch)):
+                        report_progress(processed + int(count * done / total))
+
+                    features, valid = get_frame_features(file.id, frame_indices, extractor,
+                                                         workers=app.config['TRAIN_FEATURE_WORKERS'],
+                                                         progress_callback=report_frames)
+                    for annotation, frame_index, row, ok in zip(batch, frame_indices, features, valid):
+                        if ok:
+                            matrix.append(row, annotation.behavior)
+                        else:
+                            # 帧不存在或读取失败，记录日志
+                            log.warning("读取帧图片失败: file_id=%s, 帧 %d", file.id, frame_index)
+
+            # 更新处理进度
+            processed_annotations += len(annotations)
+            report_progress(processed_annotations)
+    except BaseException:
+        matrix.close()
+        raise
+
+    log.info("特征矩阵: %d x %d %s, %.1fMB%s", matrix.count, extractor.dim, extractor.dtype,
+             matrix.count * extractor.nbytes / 2 ** 20, '（磁盘）' if matrix.spilled else '')
+    return matrix
+
+
+def _get_incremental_base(extractor):
+    """
+    获取增量训练的基础模型（最新训练的模型）
+    :return: (Model, 模型文件内容, None)，不能增量训练时返回(None, None, 原因)
+    """
+    base_model = Model.query.order_by(Model.training_time.desc()).first()
+    if base_model is None:
+        return None, None, '还没有训练过模型'
+    try:
+        bundle = joblib.load(base_model.model_path)
+    except Exception as e:
+        return None, None, f'无法加载模型文件: {e}'
+    if not supports_partial_fit(bundle['model']):
+        return None, None, '最新的模型不支持增量训练'
+    if bundle.get('feature_extractor') != extractor.key:
+        return None, None, '特征提取器已变化'
+    full_retrain_every = app.config['TRAIN_FULL_RETRAIN_EVERY']
+    if full_retrain_every and bundle.get('incremental_updates', 0) >= full_retrain_every:
+        return None, None, f'已连续增量训练 {full_retrain_every} 次'
+    return base_model, bundle, None
+
+
+def _fit_label_encoder(y, classifier):
+    """标签编码，sgd模型为已定义但还没有标注的行为预留类别，之后出现时可以直接增量训练"""
+    label_encoder = LabelEncoder()
+    if classifier == 'sgd':
+        label_encoder.fit(sorted(set(y) | {behavior.key for behavior in TeachingBehavior.query.all()}))
+    else:
+        label_encoder.fit(y)
+    return label_encoder
+
+
+def _search_model(file_annotations, report, log):
+    """
+    参数搜索：依次使用每个候选特征提取器提取特征，对分类器参数网格做k折交叉验证，
+    再用交叉验证准确率最高的特征提取器和参数在全部数据上训练
+    :return: (模型, 标签编码, 特征提取器, 样本数, 最优参数的交叉验证结果, 全部交叉验证结果)
+    """
+    extractors = [get_extractor(name) for name in app.config['TRAIN_SEARCH_EXTRACTORS']]
+    folds = app.config['TRAIN_SEARCH_FOLDS']
+    epochs = app.config['TRAIN_SGD_EPOCHS']
+    # 每个特征提取器占用20%-85%之间相同的进度，前一半提取特征，后一半交叉验证
+    span = 65 / len(extractors)
+
+    results = []
+    # (最优参数的交叉验证结果, 特征提取器, 特征矩阵)，只保留当前最优的特征矩阵
+    best = None
+    try:
+        for i, extractor in enumerate(extractors):
+            start = 20 + span * i
+            report.start_step(f'features_{extractor.name}', int(start), f'正在提取特征: {extractor.name}...')
+            matrix = _collect_training_data(file_annotations, extractor, report, log,
+                                            (int(start), int(start + span / 2)))
+            if not matrix.count:
+                log.warning("特征提取器 %s 没有提取到特征", extractor.key)
+                matrix.close()
+                continue
+
+            def report_cv(done, total, start=start + span / 2, name=extractor.name):
+                report(int(start + span / 2 * done / total), f'正在交叉验证: {name} ({done}/{total})', force=False)
+
+            report.start_step(f'cv_{extractor.name}', int(start + span / 2), f'正在交叉验证: {extractor.name}...')
+            try:
+                # 交叉验证只需要训练样本中出现的标签
+                labels, y_encoded = np.unique(matrix.labels, return_inverse=True)
+                extractor_results = cross_validate_grid(matrix.X, y_encoded, DEFAULT_SEARCH_GRID, folds,
+                                                        app.config['TRAIN_SEARCH_WORKERS'], epochs, report_cv)
+            except BaseException:
+                matrix.close()
+                raise
+            for result in extractor_results:
+                result['params'] = dict(result['params'], feature_extractor=extractor.key)
+                log.info("交叉验证: %s, 准确率: %.3f±%.3f, F1: %.3f",
+                         result['params'], result['accuracy'], result['accuracy_std'], result['f1'])
+            results.extend(extractor_results)
+            top = extractor_results[0]
+            if best is None or (top['accuracy'], top['f1']) > (best[0]['accuracy'], best[0]['f1']):
+                if best is not None:
+                    best[2].close()
+                best = (top, extractor, matrix)
+            else:
+                matrix.close()
+
+        if best is None:
+            raise TrainingError('从已标注数据中提取特征失败')
+        results.sort(key=lambda result: (result['accuracy'], result['f1']), reverse=True)
+        best_result, extractor, matrix = best
+        log.info("最优参数: %s, 交叉验证准确率: %.3f", best_result['params'], best_result['accuracy'])
+
+        report.start_step('fit', 85, '正在使用最优参数训练模型...')
+        params = {key: value for key, value in best_result['params'].items() if key != 'feature_extractor'}
+        label_encoder = _fit_label_encoder(matrix.labels, params['classifier'])
+        model = fit_all(matrix.X, label_encoder.transform(matrix.labels), n_classes=len(label_encoder.classes_),
+                        epochs=epochs, **params)
+        return model, label_encoder, extractor, matrix.count, best_result, results
+    finally:
+        if best is not None:
+            best[2].close()
+
+
+def train_model(job, report, log):
+    """
+    执行模型训练
+    :param job: TrainingJob，mode为full（使用全部标注从头训练）、incremental（在最新模型基础上只学习新增的标注）
+                或search（交叉验证选择特征提取器和分类器参数后训练）
+    :param report: JobReporter
+    :raises TrainingError: 没有可用的训练数据
+    """
+    mode = job.mode
+    extractor = get_extractor(app.config['TRAIN_FEATURE_EXTRACTOR'])
+    # 以开始时间作为模型的训练时间，训练期间新增的标注留给下一次增量训练
+    started_at = job.started_at
+    log.info("开始训练模型, 方式: %s, 特征提取器: %s", mode, extractor.key)
+    report.start_step('query', 10, '正在获取已标注数据...')
+
+    base_model = bundle = None
+    if mode == 'incremental':
+        base_model, bundle, reason = _get_incremental_base(extractor)
+        if base_model is None:
+            log.info("不能增量训练，改为全量训练: %s", reason)
+
+    if base_model is not None:
+        # 只读取基础模型训练之后新增的标注
+        annotations = load_annotations(status=None, since=base_model.training_time, until=started_at)
+        if not annotations:
+            log.info("没有新增的标注，模型无需更新: %s", base_model.model_name)
+            job.accuracy = base_model.accuracy
+            job.progress = 100
+            job.status = '没有新增的标注，模型无需更新'
+            return
+        unknown_behaviors = annotations.behaviors() - set(bundle['label_encoder'].classes_)
+        if unknown_behaviors:
+            log.info("新增的标注中有新的行为类型 %s，改为全量训练", sorted(unknown_behaviors))
+            base_model = bundle = None
+        else:
+            log.info("增量训练: 基础模型=%s, 新增标注 %d 条", base_model.model_name, len(annotations))
+
+    if base_model is None:
+        # 获取所有已标注的数据，同样不包括训练期间新增的标注，否则下一次增量训练会重复学习它们
+        annotations = load_annotations(until=started_at)
+        if not annotations:
+            raise TrainingError('没有可用的已标注数据')
+    file_annotations = annotations.items()
+
+    epochs = app.config['TRAIN_SGD_EPOCHS']
+    # 除基本信息外写入Model记录的字段
+    model_fields = {}
+    if mode == 'search':
+        model, label_encoder, extractor, training_data_size, best_result, results = \
+            _search_model(file_annotations, report, log)
+        # 准确率、精确率和召回率为最优参数的交叉验证平均值
+        accuracy = best_result['accuracy']
+        meta = {key: value for key, value in best_result['params'].items() if key != 'feature_extractor'}
+        meta.update(training_mode='search', incremental_updates=0, folds=len(best_result['folds']))
+        model_fields = {
+            'precision': best_result['precision'],
+            'recall': best_result['recall'],
+            'cv_results': json.dumps({'best': best_result, 'candidates': results})
+        }
+    else:
+        # 准备训练数据
+        report.start_step('features', 20, '正在准备训练数据...')
+        with _collect_training_data(file_annotations, extractor, report, log) as matrix:
+            if not matrix.count:
+                raise TrainingError('从已标注数据中提取特征失败')
+
+            report.start_step('fit', 80, '正在训练模型...')
+            X, y = matrix.X, matrix.labels
+            if base_model is not None:
+                # 增量训练，准确率为更新前的模型在新增标注上的准确率
+                model = bundle['model']
+                label_encoder = bundle['label_encoder']
+                accuracy = fit_incremental(model, X, label_encoder.transform(y), epochs)
+                training_data_size = base_model.training_data_size + matrix.count
+                meta = {'classifier': 'sgd', 'training_mode': 'incremental',
+                        'incremental_updates': bundle.get('incremental_updates', 0) + 1,
+                        'base_model': base_model.model_name}
+            else:
+                # 全量训练，增量模式下使用可以继续增量训练的sgd分类器
+                classifier = 'sgd' if mode == 'incremental' else app.config['TRAIN_CLASSIFIER']
+                label_encoder = _fit_label_encoder(y, classifier)
+                model, accuracy = fit_full(X, label_encoder.transform(y), classifier,
+                                           len(label_encoder.classes_), epochs)
+                training_data_size = matrix.count
+                meta = {'classifier': classifier, 'training_mode': 'full', 'incremental_updates': 0}
+
+    report.start_step('save', 95, '正在保存模型...')
+    # 保存模型
+    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    model_name = f'teaching_behavior_model_{timestamp}'
+    model_path = os.path.join('models', f'{model_name}.joblib')
+
+    # 确保models目录存在
+    if not os.path.exists('models'):
+        os.makedirs('models')
+
+    # 同时保存特征提取器，评估时使用相同的特征
+    save_bundle(model_path, model, label_encoder, extractor.key, **meta)
+    log.info("模型文件已保存: %s", model_path)
+
+    # 保存模型信息到数据库
+    new_model = Model(
+        model_name=model_name,
+        model_path=model_path,
+        training_time=started_at,
+        training_data_size=training_data_size,
+        accuracy=accuracy,
+        params=json.dumps(dict(meta, feature_extractor=extractor.key)),
+        **model_fields
+    )
+    db.session.add(new_model)
+    db.session.flush()
+    # 模型保存后不再响应取消，与任务状态一起提交
+    job.model_id = new_model.id
+    job.accuracy = accuracy
+    job.progress = 100
+    job.status = f'训练完成! 准确率: {accuracy:.2f}'
+    log.info("模型已保存到数据库: %s, 方式: %s, 样本数: %d, 准确率: %.2f",
+             model_name, meta['training_mode'], training_data_size, accuracy)
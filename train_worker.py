@@ -0,0 +1,19 @@
+"""后台训练进程的入口
+
+训练进程使用spawn启动，先导入Web应用（会依次导入routes和train_jobs），再执行训练任务，
+训练进程中的日志通过跨进程队列发回Web进程。
+"""
+from app_logging import configure_worker_logging
+
+
+def run_training_process(job_id, log_queue, log_level):
+    """
+    训练进程的入口
+    :param job_id: TrainingJob的ID
+    :param log_queue: get_worker_log_queue返回的日志队列
+    :param log_level: 日志级别
+    """
+    configure_worker_logging(log_queue, log_level)
+    from app import app  # noqa: F401
+    from train_jobs import run_training_job
+    run_training_job(job_id)
@@ -0,0 +1,277 @@
+"""行为分类器的训练
+
+支持三种训练方式：
+
+- 全量训练：使用全部标注数据从头训练，分类器可选svc（线性SVM，默认）或sgd（在线线性分类器）
+- 增量训练：在最新的sgd模型基础上用partial_fit只学习新增的标注，训练耗时与新增标注数量成正比
+- 参数搜索：对分类器参数网格做k折交叉验证（见cross_validate_grid），用最优参数在全部数据上重新训练
+
+sgd模型是 StandardScaler + SGDClassifier(log_loss) 的Pipeline，标准化参数在全量训练时确定，
+增量训练只更新线性分类器的权重。
+
+特征矩阵可以是uint8/float32的数组或磁盘上的内存映射（见feature_store.FeatureMatrix），
+训练集和测试集只按下标划分，不复制特征矩阵：sgd按小批量读取、标准化并训练，内存占用与样本数无关；
+svc（libsvm）需要把训练集整体转换为float64。该模块不依赖Flask。
+"""
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics import precision_recall_fscore_support
+from sklearn.model_selection import KFold, StratifiedKFold, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from linear_inference import export_linear, linear_path
+
+CLASSIFIERS = ('svc', 'sgd')
+
+# sgd分类器每次训练遍历数据的轮数
+DEFAULT_SGD_EPOCHS = 5
+
+# 参数搜索的默认网格：svc的正则化系数C，sgd的正则化系数alpha
+DEFAULT_SEARCH_GRID = (
+    {'classifier': 'svc', 'C': 0.1},
+    {'classifier': 'svc', 'C': 1.0},
+    {'classifier': 'svc', 'C': 10.0},
+    {'classifier': 'sgd', 'alpha': 1e-5},
+    {'classifier': 'sgd', 'alpha': 1e-4},
+    {'classifier': 'sgd', 'alpha': 1e-3},
+)
+
+# 默认的交叉验证折数
+DEFAULT_FOLDS = 5
+
+# sgd训练和预测时每批读取的样本数
+BATCH_SIZE = 1024
+
+# 交叉验证工作进程中共享的特征矩阵（只读内存映射）
+_shared_X = None
+
+
+def build_classifier(name, C=1.0, alpha=1e-4):
+    """
+    创建未训练的分类器
+    :param C: svc的正则化系数
+    :param alpha: sgd的正则化系数
+    """
+    if name == 'svc':
+        return SVC(kernel='linear', C=C, cache_size=500)
+    if name == 'sgd':
+        return Pipeline([
+            ('scaler', StandardScaler()),
+            ('clf', SGDClassifier(loss='log_loss', alpha=alpha, random_state=42))
+        ])
+    raise ValueError(f'未知的分类器: {name}')
+
+
+def supports_partial_fit(model):
+    """模型是否可以增量训练"""
+    return isinstance(model, Pipeline) and hasattr(model.named_steps.get('clf'), 'partial_fit')
+
+
+def _batches(index):
+    """按BATCH_SIZE切分下标，每批内排序以便顺序读取内存映射"""
+    for start in range(0, len(index), BATCH_SIZE):
+        yield np.sort(index[start:start + BATCH_SIZE])
+
+
+def _partial_fit_epochs(model, X, y, index, classes, epochs, seed):
+    """sgd模型按小批量训练epochs轮，每轮打乱样本顺序"""
+    scaler = model.named_steps['scaler']
+    clf = model.named_steps['clf']
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        for batch in _batches(index[rng.permutation(len(index))]):
+            clf.partial_fit(scaler.transform(X[batch]), y[batch], classes=classes)
+
+
+def predict(model, X, index=None):
+    """
+    按小批量预测
+    :param index: 需要预测的行，默认为全部
+    :return: 编码后的预测标签
+    """
+    index = np.arange(len(X)) if index is None else np.asarray(index)
+    if not len(index):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([model.predict(X[index[start:start + BATCH_SIZE]])
+                           for start in range(0, len(index), BATCH_SIZE)])
+
+
+def _fit(X, y, params, n_classes, epochs, index=None):
+    """
+    按参数创建并训练分类器，sgd模型为全部n_classes个标签预留权重
+    :param index: 参与训练的行，默认为全部
+    """
+    params = dict(params)
+    classifier = params.pop('classifier')
+    model = build_classifier(classifier, **params)
+    index = np.arange(len(y)) if index is None else np.asarray(index)
+    if classifier == 'sgd':
+        scaler = model.named_steps['scaler']
+        for batch in _batches(index):
+            scaler.partial_fit(X[batch])
+        _partial_fit_epochs(model, X, y, index, np.arange(n_classes), epochs, 42)
+    else:
+        model.fit(X[index], y[index])
+    return model
+
+
+def fit_full(X, y, classifier='svc', n_classes=None, epochs=DEFAULT_SGD_EPOCHS, **params):
+    """
+    全量训练，80%训练、20%测试
+    :param X: 特征矩阵
+    :param y: 编码后的标签
+    :param n_classes: 标签总数，sgd模型会为尚无样本的标签预留权重，之后可以增量学习
+    :param params: 分类器参数，见build_classifier
+    :return: (模型, 测试集准确率)
+    """
+    y = np.asarray(y)
+    train_index, test_index = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    n_classes = n_classes if n_classes is not None else int(y.max()) + 1
+    model = _fit(X, y, dict(params, classifier=classifier), n_classes, epochs, train_index)
+    return model, float(np.mean(predict(model, X, test_index) == y[test_index]))
+
+
+def fit_incremental(model, X, y, epochs=DEFAULT_SGD_EPOCHS):
+    """
+    用新增的样本增量训练
+    先用当前模型预测新样本得到准确率（先测后训），再用partial_fit更新模型
+    :return: 新样本上的准确率
+    """
+    y = np.asarray(y)
+    accuracy = float(np.mean(predict(model, X) == y))
+    clf = model.named_steps['clf']
+    _partial_fit_epochs(model, X, y, np.arange(len(y)), clf.classes_, epochs, len(y))
+    return accuracy
+
+
+def fit_all(X, y, classifier='svc', n_classes=None, epochs=DEFAULT_SGD_EPOCHS, **params):
+    """用全部样本训练（参数搜索确定参数后使用），返回模型"""
+    y = np.asarray(y)
+    n_classes = n_classes if n_classes is not None else int(y.max()) + 1
+    return _fit(X, y, dict(params, classifier=classifier), n_classes, epochs)
+
+
+def make_folds(y, folds=DEFAULT_FOLDS, seed=42):
+    """
+    划分交叉验证的折，样本最少的标签也有folds个样本时按标签分层
+    :return: [(训练集下标, 验证集下标), ...]
+    """
+    y = np.asarray(y)
+    folds = min(folds, len(y))
+    if folds < 2:
+        raise ValueError('样本数量太少，无法交叉验证')
+    if len(np.unique(y)) > 1 and np.bincount(y).min() >= folds:
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    else:
+        splitter = KFold(n_splits=folds, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros(len(y)), y))
+
+
+def _score_fold(X, y, train_index, test_index, params, n_classes, epochs):
+    """训练一折并返回验证集上的指标"""
+    model = _fit(X, y, params, n_classes, epochs, train_index)
+    predicted = predict(model, X, test_index)
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        y[test_index], predicted, average='macro', zero_division=0)
+    return {
+        'accuracy': float(np.mean(predicted == y[test_index])),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1': float(f1)
+    }
+
+
+def _init_cv_worker(matrix_path):
+    """交叉验证工作进程的初始化：以只读内存映射打开特征矩阵，各进程共享同一份页缓存"""
+    global _shared_X
+    _shared_X = np.load(matrix_path, mmap_mode='r')
+
+
+def _score_shared_fold(y, train_index, test_index, params, n_classes, epochs):
+    return _score_fold(_shared_X, y, train_index, test_index, params, n_classes, epochs)
+
+
+def cross_validate_grid(X, y, grid=DEFAULT_SEARCH_GRID, folds=DEFAULT_FOLDS, n_jobs=1,
+                        epochs=DEFAULT_SGD_EPOCHS, progress_callback=None):
+    """
+    对参数网格做k折交叉验证，所有(参数, 折)组合在进程池中并行训练
+    特征矩阵只写入一次临时的.npy文件，各工作进程以内存映射打开，不会为每个任务复制一份
+    :param X: 特征矩阵
+    :param y: 编码后的标签
+    :param grid: 参数列表，每项为build_classifier的参数（包括classifier）
+    :param n_jobs: 并行的进程数，为1时在当前进程中依次训练
+    :param progress_callback: 进度回调，参数为(已完成的任务数, 任务总数)
+    :return: 每组参数一项 {'params', 'folds': [每折的指标], 'accuracy', 'accuracy_std', 'precision', 'recall', 'f1'}，
+             按平均准确率（相同时按F1）从高到低排序
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    n_classes = int(y.max()) + 1
+    splits = make_folds(y, folds)
+    tasks = [(params, train_index, test_index) for params in grid for train_index, test_index in splits]
+
+    scores = [None] * len(tasks)
+    if n_jobs <= 1:
+        for i, (params, train_index, test_index) in enumerate(tasks):
+            scores[i] = _score_fold(X, y, train_index, test_index, params, n_classes, epochs)
+            if progress_callback is not None:
+                progress_callback(i + 1, len(tasks))
+    else:
+        with tempfile.TemporaryDirectory(prefix='cv_') as tmp_dir:
+            matrix_path = os.path.join(tmp_dir, 'X.npy')
+            np.save(matrix_path, X)
+            # 使用spawn启动子进程，与帧提取的进程池一致
+            executor = ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks)),
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_cv_worker, initargs=(matrix_path,))
+            try:
+                futures = {executor.submit(_score_shared_fold, y, train_index, test_index, params, n_classes, epochs): i
+                           for i, (params, train_index, test_index) in enumerate(tasks)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    scores[futures[future]] = future.result()
+                    if progress_callback is not None:
+                        progress_callback(done, len(tasks))
+            finally:
+                # 进度回调抛出异常（例如训练被取消）时不再执行排队中的任务
+                executor.shutdown(cancel_futures=True)
+
+    results = []
+    for i, params in enumerate(grid):
+        fold_scores = scores[i * len(splits):(i + 1) * len(splits)]
+        accuracies = [score['accuracy'] for score in fold_scores]
+        results.append({
+            'params': dict(params),
+            'folds': fold_scores,
+            'accuracy': float(np.mean(accuracies)),
+            'accuracy_std': float(np.std(accuracies)),
+            'precision': float(np.mean([score['precision'] for score in fold_scores])),
+            'recall': float(np.mean([score['recall'] for score in fold_scores])),
+            'f1': float(np.mean([score['f1'] for score in fold_scores]))
+        })
+    results.sort(key=lambda result: (result['accuracy'], result['f1']), reverse=True)
+    return results
+
+
+def save_bundle(path, model, label_encoder, feature_extractor, **meta):
+    """
+    保存模型文件，线性模型同时导出权重矩阵（见linear_inference）
+    先写入临时文件再替换，训练进程中途退出时不会留下不完整的模型文件；
+    导出文件在模型文件替换之前写入，修改时间不早于模型文件
+    :param feature_extractor: 特征提取器的键，见features.FeatureExtractor.key
+    :param meta: 其他训练信息，例如classifier、training_mode、incremental_updates
+    """
+    bundle = {'model': model, 'label_encoder': label_encoder, 'feature_extractor': feature_extractor}
+    bundle.update(meta)
+    joblib.dump(bundle, path + '.tmp')
+    linear = export_linear(model, label_encoder)
+    if linear is not None:
+        linear.save(linear_path(path))
+    os.replace(path + '.tmp', path)
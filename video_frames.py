@@ -0,0 +1,477 @@
+"""视频帧提取引擎
+
+按固定时间间隔从视频中抽取帧，JPEG编码后写入每个视频一个的帧打包文件（见frame_store）。被跳过的帧只调用 ``cap.grab()``
+（不做颜色转换和拷贝），间隔较大时直接定位到目标帧（由解码器从最近的关键帧开始解码），
+使提取耗时与保留的帧数成正比，而不是与视频长度成正比。
+解码出的帧同时缩小编码为预览图（缩略图、中等尺寸），页面不必加载原始帧。
+
+除固定间隔采样外还支持按场景变化采样（sampling='scene'）：按较短的探测间隔解码候选帧，
+与上一个保留的帧比较缩小后的灰度图和直方图，画面变化超过阈值时才保留，
+静止的讲课画面只保留少量帧，短暂的动作也不容易被漏掉。
+
+该模块不依赖Flask，可以在独立进程中调用。
+"""
+import os
+import time
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from app_logging import configure_worker_logging, get_job_logger
+from frame_store import FrameSetWriter, get_pack_path, merge_packs, remove_stale_variants
+
+logger = logging.getLogger(__name__)
+
+# 可选的提取策略
+#   grab: 顺序读取，跳过的帧只grab不retrieve
+#   seek: 每个目标帧都通过CAP_PROP_POS_FRAMES定位
+#   auto: 与上一个目标帧的距离超过seek_min_gap时定位，否则顺序grab
+EXTRACT_STRATEGIES = ('auto', 'grab', 'seek')
+
+# 默认最多提取的帧数
+DEFAULT_MAX_FRAMES = 200
+
+# auto策略下触发定位的最小帧距离，大于常见编码器的关键帧间隔(GOP)时定位才划算
+DEFAULT_SEEK_MIN_GAP = 300
+
+# 视频帧率未知时使用的默认帧率
+DEFAULT_FPS = 30
+
+# 可选的采样方式
+#   interval: 按固定时间间隔采样
+#   scene: 按探测间隔解码候选帧，只保留画面变化超过阈值的帧
+SAMPLING_MODES = ('interval', 'scene')
+
+# 场景采样的默认参数：变化阈值（0-1）、相邻保留帧的最小/最大间隔（秒）
+DEFAULT_SCENE_THRESHOLD = 0.25
+DEFAULT_SCENE_MIN_GAP = 1.0
+DEFAULT_SCENE_MAX_GAP = 30.0
+
+
+def open_video_capture(video_path):
+    """
+    打开视频文件，依次尝试原路径、绝对路径和FFMPEG后端
+    :param video_path: 视频文件路径
+    :return: 已打开的cv2.VideoCapture对象
+    """
+    cap = cv2.VideoCapture(video_path)
+    if cap.isOpened():
+        return cap
+
+    abs_path = os.path.abspath(video_path)
+    logger.warning("无法打开视频文件，尝试使用绝对路径: %s", abs_path)
+    cap = cv2.VideoCapture(abs_path)
+    if cap.isOpened():
+        return cap
+
+    logger.warning("尝试使用FFMPEG后端打开视频文件: %s", video_path)
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if cap.isOpened():
+        return cap
+
+    raise Exception(f'无法打开视频文件: {video_path}')
+
+
+def get_video_info(cap):
+    """
+    获取视频的总帧数和帧率
+    :return: (total_frames, fps)，总帧数未知时为-1
+    """
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    except Exception:
+        total_frames = -1
+    if total_frames <= 0:
+        total_frames = -1
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+    except Exception:
+        fps = 0
+    if not fps or fps <= 0:
+        fps = DEFAULT_FPS
+
+    return total_frames, fps
+
+
+def plan_frame_numbers(total_frames, fps, interval, max_frames=DEFAULT_MAX_FRAMES):
+    """
+    计算需要保留的源帧编号
+    :param total_frames: 视频总帧数，未知时为-1
+    :param fps: 视频帧率
+    :param interval: 帧间隔（秒）
+    :param max_frames: 最多提取的帧数
+    :return: 源帧编号列表（总帧数未知时按max_frames规划，读到视频结尾即停止）
+    """
+    frame_interval = max(int(fps * interval), 1)
+
+    if total_frames > 0:
+        video_length = total_frames / fps
+        # 根据视频长度和帧间隔计算理论最大提取帧数
+        count = int(video_length / interval) + 1 if interval > 0 else total_frames
+        count = min(count, (total_frames - 1) // frame_interval + 1)
+    else:
+        count = max_frames
+
+    if max_frames:
+        count = min(count, max_frames)
+
+    return [i * frame_interval for i in range(count)]
+
+
+def iter_video_frames(cap, frame_numbers, strategy='auto', seek_min_gap=DEFAULT_SEEK_MIN_GAP):
+    """
+    按源帧编号依次解码目标帧
+    :param cap: 已打开的cv2.VideoCapture对象，读取位置需在frame_numbers[0]之前
+    :param frame_numbers: 递增的源帧编号
+    :param strategy: 提取策略，见EXTRACT_STRATEGIES
+    :param seek_min_gap: auto策略下触发定位的最小帧距离
+    :return: 生成(源帧编号, 帧图像)，读到视频结尾时停止
+    """
+    if strategy not in EXTRACT_STRATEGIES:
+        raise ValueError(f'未知的提取策略: {strategy}')
+
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+    can_seek = strategy != 'grab'
+
+    for target in frame_numbers:
+        if target < position:
+            continue
+
+        gap = target - position
+        if can_seek and gap > 0 and (strategy == 'seek' or gap >= seek_min_gap):
+            if cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+                actual = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+                if actual == target:
+                    position = target
+                elif position <= actual < target:
+                    # 只定位到了目标之前，剩余部分顺序grab
+                    position = actual
+                else:
+                    # 定位结果不可信，之后不再定位
+                    can_seek = False
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+            else:
+                can_seek = False
+
+        # 跳过的帧只grab，不做retrieve
+        while position < target:
+            if not cap.grab():
+                return
+            position += 1
+
+        ret, frame = cap.read()
+        position += 1
+        if not ret:
+            return
+        if frame is None:
+            continue
+        yield target, frame
+
+
+class SceneChangeDetector:
+    """
+    判断候选帧相对上一个保留的帧是否发生了场景变化
+
+    每帧缩小为 size x size 的灰度图，差异取平均像素差和灰度直方图巴氏距离中的较大值（0-1），
+    前者对画面布局的变化敏感，后者对整体亮度和内容的变化敏感。
+    """
+
+    def __init__(self, fps, threshold=DEFAULT_SCENE_THRESHOLD, min_gap=DEFAULT_SCENE_MIN_GAP,
+                 max_gap=DEFAULT_SCENE_MAX_GAP, size=32, bins=16):
+        """
+        :param fps: 视频帧率，用于把源帧编号换算为秒
+        :param threshold: 差异超过该值时保留
+        :param min_gap: 与上一个保留帧的最小间隔（秒），间隔内的帧不做比较
+        :param max_gap: 与上一个保留帧的最大间隔（秒），超过后无论是否变化都保留
+        """
+        self.fps = fps
+        self.threshold = threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.size = size
+        self.bins = bins
+        self._last_frame_no = None
+        self._last_signature = None
+
+    def signature(self, frame):
+        small = cv2.resize(frame, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        hist = cv2.calcHist([gray], [0], None, [self.bins], [0, 256])
+        cv2.normalize(hist, hist)
+        return gray.astype(np.float32), hist
+
+    def difference(self, a, b):
+        pixel_diff = float(np.mean(np.abs(a[0] - b[0]))) / 255.0
+        hist_diff = cv2.compareHist(a[1], b[1], cv2.HISTCMP_BHATTACHARYYA)
+        return max(pixel_diff, hist_diff)
+
+    def keep(self, frame_no, frame):
+        """是否保留该帧，保留时把它作为之后比较的基准"""
+        if self._last_frame_no is not None:
+            gap = (frame_no - self._last_frame_no) / self.fps
+            if gap < self.min_gap:
+                return False
+            signature = self.signature(frame)
+            if gap < self.max_gap and self.difference(signature, self._last_signature) < self.threshold:
+                return False
+        else:
+            signature = self.signature(frame)
+        self._last_frame_no = frame_no
+        self._last_signature = signature
+        return True
+
+
+def _seek_before(cap, video_path, target):
+    """
+    把读取位置定位到target或之前，之后由iter_video_frames顺序grab到目标帧
+    部分编码格式只能定位到关键帧，定位到目标之后或定位失败时重新打开视频从头读取，保证不漏帧
+    :return: (cv2.VideoCapture对象, 是否退回到了视频开头)
+    """
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+        actual = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if 0 <= actual <= target:
+            return cap, False
+    cap.release()
+    return open_video_capture(video_path), True
+
+
+def _extract_chunk(video_path, output_dir, suffix, frame_numbers, strategy, seek_min_gap, previews):
+    """
+    子进程中提取一段连续的目标帧，使用独立的VideoCapture并先定位到该段的第一个目标帧
+    :param suffix: 该段打包文件名的后缀
+    :return: (按顺序成功保存的帧 [(源帧编号, 宽, 高), ...], 是否因定位不准退回到视频开头读取)
+    """
+    cap = open_video_capture(video_path)
+    saved = []
+    rewound = False
+    try:
+        if frame_numbers[0] > 0:
+            cap, rewound = _seek_before(cap, video_path, frame_numbers[0])
+        with FrameSetWriter(output_dir, previews, suffix) as writer:
+            for frame_no, frame in iter_video_frames(cap, frame_numbers, strategy, seek_min_gap):
+                if writer.append_image(frame) is not None:
+                    saved.append((frame_no, frame.shape[1], frame.shape[0]))
+        return saved, rewound
+    finally:
+        cap.release()
+
+
+def _extract_parallel(video_path, output_dir, frame_numbers, workers, strategy, seek_min_gap, previews,
+                      progress_callback, log):
+    """
+    把目标帧切分为workers段，每段在独立进程中解码并写入各自的打包文件，最后按顺序合并
+    :return: 按包内顺序成功保存的帧 [(源帧编号, 宽, 高), ...]
+    """
+    chunk_size = (len(frame_numbers) + workers - 1) // workers
+    chunks = [frame_numbers[start:start + chunk_size] for start in range(0, len(frame_numbers), chunk_size)]
+    suffixes = [f'.part{i:02d}' for i in range(len(chunks))]
+    log.info("并行提取: %d 个进程, %d 段, 每段最多 %d 帧", workers, len(chunks), chunk_size)
+
+    variants = ['full'] + [spec.variant for spec in previews]
+    part_paths = [get_pack_path(output_dir, variant) + suffix for variant in variants for suffix in suffixes]
+    try:
+        saved_count = 0
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+            futures = [executor.submit(_extract_chunk, video_path, output_dir, suffix, chunk, strategy,
+                                       seek_min_gap, previews)
+                       for suffix, chunk in zip(suffixes, chunks)]
+            for future in as_completed(futures):
+                saved_count += len(future.result()[0])
+                if progress_callback is not None:
+                    progress_callback(saved_count, len(frame_numbers))
+
+        # 子进程没有配置日志，在这里记录定位不准和没有保存的目标帧
+        for suffix, chunk, future in zip(suffixes, chunks, futures):
+            saved, rewound = future.result()
+            if rewound:
+                log.warning("段 %s 无法定位到源帧 %d，已从视频开头顺序读取", suffix, chunk[0])
+            if len(saved) < len(chunk):
+                log.warning("段 %s 有 %d 个目标帧未保存（读到视频结尾或解码失败）", suffix, len(chunk) - len(saved))
+
+        # 按段的顺序合并，某段提前读到视频结尾时后续帧编号自然前移，保持连续
+        # 原始帧最后合并，见FrameSetWriter.close
+        for variant in reversed(variants):
+            pack_path = get_pack_path(output_dir, variant)
+            merge_packs([pack_path + suffix for suffix in suffixes], pack_path)
+        remove_stale_variants(output_dir, variants)
+    finally:
+        # 合并成功时分段文件已被删除；某段失败时删除其他段已写入的分段文件和中断留下的临时文件
+        for part_path in part_paths:
+            for path in (part_path, f'{part_path}.tmp'):
+                if os.path.exists(path):
+                    os.remove(path)
+    return [saved for future in futures for saved in future.result()[0]]
+
+
+def _frame_record(index, frame_no, fps, width, height, pack_path):
+    """帧清单中的一项，对应models.Frame的各列"""
+    return {
+        'frame_index': index,
+        'source_frame': frame_no,
+        'timestamp': frame_no / fps,
+        'path': pack_path,
+        'width': width,
+        'height': height
+    }
+
+
+def extract_video_frames(video_path, output_dir, interval=1, strategy='auto',
+                         max_frames=DEFAULT_MAX_FRAMES, seek_min_gap=DEFAULT_SEEK_MIN_GAP,
+                         progress_callback=None, log=None, workers=1, previews=(), sampling='interval',
+                         scene_threshold=DEFAULT_SCENE_THRESHOLD, scene_min_gap=DEFAULT_SCENE_MIN_GAP,
+                         scene_max_gap=DEFAULT_SCENE_MAX_GAP):
+    """
+    提取视频帧并保存到指定目录
+    :param video_path: 视频文件路径
+    :param output_dir: 输出目录
+    :param interval: 帧间隔，默认为1秒；场景采样时为候选帧的探测间隔
+    :param strategy: 提取策略，auto/grab/seek
+    :param max_frames: 最多提取的帧数
+    :param seek_min_gap: auto策略下触发定位的最小帧距离
+    :param progress_callback: 进度回调，参数为(已提取帧数, 计划提取帧数)
+    :param log: 日志记录器，默认为本模块的logger，可传入带任务上下文的LoggerAdapter
+    :param workers: 并行解码的进程数，大于1且视频总帧数已知时把视频切分为多段并行提取
+    :param previews: 同时生成的预览图规格（frame_store.PreviewSpec列表）
+    :param sampling: 采样方式，见SAMPLING_MODES
+    :param scene_threshold: 场景采样的变化阈值，见SceneChangeDetector
+    :param scene_min_gap: 场景采样时相邻保留帧的最小间隔（秒）
+    :param scene_max_gap: 场景采样时相邻保留帧的最大间隔（秒）
+    :return: 帧清单，每帧一个字典，见 :func:`_frame_record`
+    """
+    log = log or logger
+    log.info("开始提取视频帧: 视频=%s, 输出目录=%s, 帧间隔=%s秒, 策略=%s, 采样=%s",
+             video_path, output_dir, interval, strategy, sampling)
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f'未知的采样方式: {sampling}')
+
+    # 检查视频文件
+    if not os.path.exists(video_path):
+        log.error("视频文件不存在: %s", video_path)
+        raise Exception(f'视频文件不存在: {video_path}')
+    if os.path.getsize(video_path) == 0:
+        log.error("视频文件为空: %s", video_path)
+        raise Exception(f'视频文件为空: {video_path}')
+
+    # 确保输出目录存在
+    if not os.path.exists(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except Exception as e:
+            log.error("创建帧目录失败: %s", e)
+            raise Exception(f'创建帧目录失败: {str(e)}')
+
+    cap = None
+    saved = []
+    start_time = time.perf_counter()
+    try:
+        cap = open_video_capture(video_path)
+        total_frames, fps = get_video_info(cap)
+        detector = None
+        if sampling == 'scene':
+            # 候选帧不受max_frames限制，保留的帧数达到max_frames时停止
+            detector = SceneChangeDetector(fps, scene_threshold, scene_min_gap, scene_max_gap)
+            if total_frames > 0:
+                frame_numbers = plan_frame_numbers(total_frames, fps, interval, max_frames=None)
+            else:
+                frame_numbers = itertools.count(0, max(int(fps * interval), 1))
+            planned = len(frame_numbers) if total_frames > 0 else 0
+            log.info("视频总帧数: %s, 帧率: %s, 候选帧: %d 帧", total_frames, fps, planned)
+        else:
+            frame_numbers = plan_frame_numbers(total_frames, fps, interval, max_frames)
+            planned = len(frame_numbers)
+            log.info("视频总帧数: %s, 帧率: %s, 计划提取: %d 帧", total_frames, fps, planned)
+
+        # 每个进程至少分到2帧时才值得并行；场景采样需要与上一个保留帧比较，只能顺序提取
+        if detector is None and workers > 1 and total_frames > 0 and planned >= 2 * workers:
+            cap.release()
+            cap = None
+            saved = _extract_parallel(video_path, output_dir, frame_numbers, workers, strategy,
+                                      seek_min_gap, previews, progress_callback, log)
+        else:
+            with FrameSetWriter(output_dir, previews) as writer:
+                for probed, (frame_no, frame) in enumerate(
+                        iter_video_frames(cap, frame_numbers, strategy, seek_min_gap), 1):
+                    if detector is not None:
+                        # 场景采样的进度按已探测的候选帧计算
+                        if progress_callback is not None:
+                            progress_callback(probed, planned)
+                        if not detector.keep(frame_no, frame):
+                            continue
+                    index = writer.append_image(frame)
+                    if index is None:
+                        log.warning("帧编码失败 (源帧 %d)", frame_no)
+                        continue
+                    saved.append((frame_no, frame.shape[1], frame.shape[0]))
+                    log.debug("保存帧 %d (源帧 %d)", index, frame_no)
+                    if detector is None:
+                        if progress_callback is not None:
+                            progress_callback(len(writer), planned)
+                    elif max_frames and len(writer) >= max_frames:
+                        log.info("已达到最多提取帧数 %d，停止场景采样", max_frames)
+                        break
+    except Exception:
+        log.exception("处理视频时发生错误: %s", video_path)
+        raise
+    finally:
+        if cap is not None:
+            cap.release()
+
+    elapsed = time.perf_counter() - start_time
+    log.info("视频帧提取完成，共提取 %d 帧，耗时 %.2f 秒", len(saved), elapsed)
+    pack_path = get_pack_path(output_dir)
+    return [_frame_record(index, frame_no, fps, width, height, pack_path)
+            for index, (frame_no, width, height) in enumerate(saved)]
+
+
+def run_extraction_job(job_key, video_path, output_dir, intervals=(3, 0.5), strategy='auto', progress=None,
+                       log_queue=None, log_level='INFO', workers=1, previews=(), sampling='interval',
+                       scene_options=None):
+    """
+    后台进程中执行的帧提取任务，依次尝试intervals中的帧间隔，直到提取到帧为止
+    :param job_key: 任务标识（数据文件ID），用作progress中的键
+    :param progress: 可跨进程共享的字典（multiprocessing.Manager().dict()），用于上报进度
+    :param log_queue: 主进程的日志队列，见app_logging.get_worker_log_queue
+    :param log_level: 后台进程的日志级别
+    :param workers: 单个视频并行解码的进程数
+    :param previews: 预览图规格，见extract_video_frames
+    :param sampling: 采样方式，见SAMPLING_MODES
+    :param scene_options: 场景采样参数，{'scene_threshold', 'scene_min_gap', 'scene_max_gap'}
+    :return: 帧清单，见extract_video_frames
+    """
+    configure_worker_logging(log_queue, log_level)
+    log = get_job_logger(__name__, file_id=job_key)
+
+    def report(done, total):
+        if progress is not None:
+            progress[job_key] = {'state': 'running', 'done': done, 'total': total, 'error': None}
+
+    report(0, 0)
+    manifest = []
+    try:
+        for interval in intervals:
+            manifest = extract_video_frames(video_path, output_dir, interval=interval,
+                                            strategy=strategy, progress_callback=report, log=log,
+                                            workers=workers, previews=previews, sampling=sampling,
+                                            **(scene_options or {}))
+            if manifest:
+                break
+            log.warning("帧间隔 %s 秒未提取到帧", interval)
+    except Exception as e:
+        if progress is not None:
+            progress[job_key] = {'state': 'failed', 'done': 0, 'total': 0, 'error': str(e)}
+        raise
+
+    if progress is not None:
+        progress[job_key] = {
+            'state': 'done' if manifest else 'failed',
+            'done': len(manifest),
+            'total': len(manifest),
+            'error': None if manifest else '未能从视频中提取到帧'
+        }
+    return manifest